@@ -1,35 +1,66 @@
 import os
 import cv2
+import functools
 import numpy as np
 import random
+from rng import get_rng
+from color_lut import ColorChain
 
-def generate_random_lines(imshape, slant_range, drop_length):
-    drops = []
-    for i in range(1500):  # If you want heavy rain, try increasing this
-        slant = np.random.randint(-slant_range, slant_range)
-        if slant < 0:
-            x = np.random.randint(slant, imshape[1])
-        else:
-            x = np.random.randint(0, imshape[1] - slant)
-            y = np.random.randint(0, imshape[0] - drop_length)
-            drops.append((x, y, slant))
-    return drops
+RAIN_DROPS = 750  # If you want heavy rain, try increasing this
+# Number of pre-rendered rain layers kept per (resolution, drop length, drops), and in total
+RAIN_LAYER_VARIANTS = 4
+RAIN_BANK_SIZE = 64
+RAIN_SLANT = 5  # Set a fixed value for slant (you can adjust this value)
+RAIN_BRIGHTNESS = 0.7  # rainy days are usually shady
+DROP_COLOR = (200, 200, 200)  # a shade of gray
 
+@functools.lru_cache(maxsize=RAIN_BANK_SIZE)
+def rain_layer(height, width, drop_length, slant, number_of_drops, variant=0):
+    """
+    Pre-rendered rain layer of a height x width image, as the (rows, columns) of its streak pixels.
+    The layer wraps around the image edges, so it can be shifted by any (x, y) offset without seams.
+    """
+    rng = np.random.default_rng([height, width, drop_length, slant, number_of_drops, variant])
+    starts = np.stack([rng.integers(0, width, number_of_drops), rng.integers(0, height, number_of_drops)], axis=1)
+    segments = np.stack([starts, starts + [slant, drop_length]], axis=1)
+    # Draw the streaks that cross an edge a second time on the opposite side
+    segments = np.concatenate([segments + [dx, dy] for dx in (0, -width) for dy in (0, -height)]).astype(np.int32)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.polylines(mask, segments, False, 255, 1)
+    rows, columns = np.nonzero(mask)
+    return rows.astype(np.int32), columns.astype(np.int32)
 
-def add_rain(image, drop_length):
+def rain_streaks(height, width, drop_length, rng=None, number_of_drops=RAIN_DROPS):
+    """
+    Flat pixel indices of the rain streaks of a height x width image, a layer of the bank shifted by a random
+    offset that wraps around horizontally and vertically.
+    """
+    rng = get_rng(rng)
+    rows, columns = rain_layer(height, width, drop_length, RAIN_SLANT, number_of_drops, int(rng.integers(RAIN_LAYER_VARIANTS)))
+    offset_y, offset_x = divmod(int(rng.integers(height * width)), width)
+    return (rows + offset_y) % height * width + (columns + offset_x) % width
+
+def rain_darkening():
+    """
+    The ColorChain darkening a rainy image and the RGB color of the drops drawn on it afterwards.
+    """
+    # Darken with a channel scaling in place of the RGB -> HLS -> RGB round-trip, lightness scaling
+    # is a plain scaling of the channels for the darker half of the colors and the gray drops
+    darken = ColorChain().brightness(RAIN_BRIGHTNESS)
+    return darken, darken.apply(np.array([[DROP_COLOR]], dtype=np.uint8))[0, 0]
+
+def add_rain(image, drop_length, rng=None, number_of_drops=RAIN_DROPS):
+    """
+    Draw rain streaks on an RGB uint8 image and darken it, in place. The streaks come from a bank
+    of pre-rendered layers shifted by a random offset, so heavy rain costs about the same as light rain.
+    """
     try:
-        imshape = image.shape
-        slant = 5  # Set a fixed value for slant (you can adjust this value)
-        drop_width = 1
-        drop_color = (200, 200, 200)  # a shade of gray
-        rain_drops = generate_random_lines(imshape, slant, drop_length)
-        for rain_drop in rain_drops:
-            cv2.line(image, (rain_drop[0], rain_drop[1]), (rain_drop[0] + slant, rain_drop[1] + drop_length), drop_color, drop_width)
-        brightness_coefficient = 0.7  # rainy days are usually shady
-        image_HLS = cv2.cvtColor(image, cv2.COLOR_RGB2HLS)  # Conversion to HLS
-        image_HLS[:, :, 1] = image_HLS[:, :, 1] * brightness_coefficient  # scale pixel values down for channel 1 (Lightness)
-        image_RGB = cv2.cvtColor(image_HLS, cv2.COLOR_HLS2RGB)  # Conversion to RGB
-        return image_RGB
+        height, width = image.shape[:2]
+        streaks = rain_streaks(height, width, drop_length, rng, number_of_drops)
+        darken, drop_color = rain_darkening()
+        darken.apply(image)
+        image.reshape(-1, image.shape[2])[streaks] = drop_color
+        return image
     except Exception as e:
         print(f"Error in image processing: {e}")
-        return None
\ No newline at end of file
+        return None
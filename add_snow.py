@@ -1,14 +1,12 @@
 import os
-import cv2
-import numpy as np
+from color_lut import ColorChain
 
-def add_snow(image):
-    image_HLS = cv2.cvtColor(image, cv2.COLOR_RGB2HLS)  # Conversion to HLS
-    image_HLS = np.array(image_HLS, dtype=np.float64)
+def snow_chain():
     brightness_coefficient = 2.0
     snow_point = 90  # Increase this for more snow
-    image_HLS[:, :, 1][image_HLS[:, :, 1] < snow_point] = image_HLS[:, :, 1][image_HLS[:, :, 1] < snow_point] * brightness_coefficient  # Scale pixel values up for channel 1 (Lightness)
-    image_HLS[:, :, 1][image_HLS[:, :, 1] > 255] = 255  # Sets all values above 255 to 255
-    image_HLS = np.array(image_HLS, dtype=np.uint8)
-    image_RGB = cv2.cvtColor(image_HLS, cv2.COLOR_HLS2RGB)  # Conversion to RGB
-    return image_RGB
\ No newline at end of file
+    # Scale the lightness of the pixels darker than snow_point up, on the HLS image
+    return ColorChain().lightness(brightness_coefficient, below=snow_point)
+
+def add_snow(image):
+    # In place
+    return snow_chain().apply(image)
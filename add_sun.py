@@ -1,32 +1,37 @@
 
 import os
-from PIL import Image, ImageEnhance
+import numpy as np
+from PIL import Image
 import random
+from rng import get_rng
+from color_lut import ColorChain
 
-def apply_sunny_effect(image, brightness_factor=1.2, contrast_factor=1.2, tint_color=(255, 255, 150)):
+def sunny_chain(brightness_factor=1.2, contrast_factor=1.2, tint_color=(255, 255, 150), rng=None):
     """
-    Apply a sunny effect to the input PIL image.
+    The ColorChain of apply_sunny_effect, with its random tint strength drawn from rng.
+    """
+    # Brightness and contrast enhancement and the yellow tint, compiled into a single lookup table
+    chain = ColorChain().brightness(brightness_factor).contrast(contrast_factor)
+    return chain.blend(tint_color, get_rng(rng).uniform(0.1, 0.3))
+
+def apply_sunny_effect(image, brightness_factor=1.2, contrast_factor=1.2, tint_color=(255, 255, 150), rng=None):
+    """
+    Apply a sunny effect to the input image.
 
     Parameters:
-    image (PIL.Image): The input image.
+    image (PIL.Image or numpy.ndarray): The input image, a uint8 array is modified in place.
     brightness_factor (float): Controls the brightness enhancement. Default is 1.2.
     contrast_factor (float): Controls the contrast enhancement. Default is 1.2.
     tint_color (tuple): The color used to add a yellow tint to the image. Default is (255, 255, 150).
+    rng (numpy.random.Generator): Source of the random tint strength. Default draws from np.random.
 
     Returns:
-    PIL.Image: The image with the sunny effect applied.
+    PIL.Image or numpy.ndarray: The image with the sunny effect applied, of the same type as image.
     """
-    # Apply brightness enhancement
-    enhancer = ImageEnhance.Brightness(image)
-    enhanced_image = enhancer.enhance(brightness_factor)
-
-    # Apply contrast enhancement
-    enhancer = ImageEnhance.Contrast(enhanced_image)
-    enhanced_image = enhancer.enhance(contrast_factor)
-
-    # Add yellow tint to the image
-    tint_layer = Image.new("RGB", image.size, tint_color).convert('RGBA')
-    tinted_image = Image.blend(enhanced_image, tint_layer, random.uniform(0.1, 0.3))
+    chain = sunny_chain(brightness_factor, contrast_factor, tint_color, rng)
+    if isinstance(image, np.ndarray):
+        return chain.apply(image)
+    tinted_image = chain.apply(np.array(image))
 
-    return tinted_image
+    return Image.fromarray(tinted_image)
 
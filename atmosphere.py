@@ -0,0 +1,150 @@
+import functools
+import cv2
+import numpy as np
+from rng import get_rng
+
+# Longest side of the low resolution density maps, they are upsampled to the image size when blending
+DENSITY_MAP_SIZE = 64
+# Grid sizes of the noise octaves summed into a density map, coarsest first
+NOISE_OCTAVES = (4, 8, 16)
+# Number of image resolutions whose blending buffers are kept
+BUFFER_CACHE_SIZE = 4
+# Pixels blended per cv2.blendLinear call by blend_densities, small images are blended several at a time
+BLEND_MAX_PIXELS = 1 << 20
+
+def density_grid(height, width):
+    """
+    Shape (rows, cols) of the low resolution density map of a height x width image, same aspect ratio.
+    """
+    scale = DENSITY_MAP_SIZE / max(height, width)
+    return max(2, round(height * scale)), max(2, round(width * scale))
+
+def noise_density(shape, rng, octaves=NOISE_OCTAVES):
+    """
+    Smooth random density in [0, 1] of the given shape, the sum of a pyramid of coarse noise octaves.
+    """
+    rows, cols = shape
+    density = np.zeros(shape, dtype=np.float32)
+    for level, size in enumerate(octaves):
+        coarse_shape = (max(2, round(size * rows / max(shape))), max(2, round(size * cols / max(shape))))
+        coarse = rng.random(coarse_shape, dtype=np.float32)
+        density += cv2.resize(coarse, (cols, rows), interpolation=cv2.INTER_CUBIC) / 2 ** level
+    cv2.normalize(density, density, 0, 1, cv2.NORM_MINMAX)
+    return density
+
+def grid_distance(shape, height, width, center):
+    """
+    Distance in image pixels from center (x, y) of every cell of a low resolution map of a height x width image.
+    """
+    rows, cols = shape
+    x = (np.arange(cols, dtype=np.float32) + 0.5) * width / cols - center[0]
+    y = (np.arange(rows, dtype=np.float32) + 0.5) * height / rows - center[1]
+    return np.hypot(x[None, :], y[:, None])
+
+@functools.lru_cache(maxsize=BUFFER_CACHE_SIZE)
+def _weight_buffers(height, width):
+    # Blending weights of one resolution, reused by every call at that resolution
+    return np.empty((height, width), dtype=np.float32), np.empty((height, width), dtype=np.float32)
+
+@functools.lru_cache(maxsize=BUFFER_CACHE_SIZE)
+def _color_plane(height, width, channels, color):
+    plane = np.empty((height, width, channels), dtype=np.uint8)
+    plane[:] = color
+    return plane
+
+def blend_density(image, density, color):
+    """
+    Blend color into an HxWxC uint8 image in place, weighted by a low resolution density map in [0, 1]
+    upsampled to the image size. Returns the image.
+    """
+    return blend_densities(image[None], [density], color)[0]
+
+def blend_densities(images, densities, color):
+    """
+    Blend color into every image of an N x H x W x C uint8 stack in place, images[i] weighted by densities[i]
+    like blend_density. The images are blended as tall images of up to BLEND_MAX_PIXELS pixels, one
+    cv2.blendLinear call each, with buffers kept per resolution. Returns the stack.
+    """
+    count, height, width, channels = images.shape
+    part = max(1, BLEND_MAX_PIXELS // (height * width))
+    weights, inverses = _weight_buffers(part * height, width)
+    plane = _color_plane(part * height, width, channels, tuple(color))
+    for start in range(0, count, part):
+        stop = min(start + part, count)
+        rows = (stop - start) * height
+        weight, inverse = weights[:rows], inverses[:rows]
+        for i in range(start, stop):
+            cv2.resize(densities[i].astype(np.float32), (width, height), dst=weight[(i - start) * height:(i - start + 1) * height],
+                       interpolation=cv2.INTER_LINEAR)
+        np.subtract(1, weight, out=inverse)
+        tall = images[start:stop].reshape(-1, width, channels)
+        cv2.blendLinear(tall, plane[:rows], inverse, weight, dst=tall)
+    return images
+
+def fog_density(height, width, radius=1000, rng=None):
+    """
+    The low resolution density map and the color of the fog add_fog covers a height x width image with.
+    """
+    rng = get_rng(rng)
+    fog_color = (190, 187, 186)
+    # Generate random fog density between 0.3 and 0.7
+    density = rng.uniform(0.3, 0.7)
+    shape = density_grid(height, width)
+
+    # Thicker and thinner patches between 70% and 100% of the density
+    fog = density * (0.7 + 0.3 * noise_density(shape, rng))
+    distance = grid_distance(shape, height, width, (width / 2, height / 2))
+    edge = 0.25 * radius
+    fog *= np.clip((radius + edge - distance) / edge, 0, 1)
+    return fog, fog_color
+
+def add_fog(image, radius=1000, rng=None):
+    """
+    Cover an RGB uint8 image with patchy fog, in place. The fog fades out smoothly past radius pixels
+    from the center of the image.
+    """
+    height, width = image.shape[:2]
+    return blend_density(image, *fog_density(height, width, radius, rng))
+
+def haze_density(height, width, rng=None):
+    """
+    The low resolution density map and the color of the haze add_haze adds to a height x width image.
+    """
+    rng = get_rng(rng)
+    haze_color = (200, 205, 215)
+    strength = rng.uniform(0.2, 0.5)
+    shape = density_grid(height, width)
+
+    depth = np.linspace(1.0, 0.2, shape[0], dtype=np.float32)[:, None]
+    haze = strength * depth * (0.8 + 0.2 * noise_density(shape, rng))
+    return haze, haze_color
+
+def add_haze(image, rng=None):
+    """
+    Add a bluish haze to an RGB uint8 image, in place, thicker towards the top of the image where the
+    scene is usually farther away.
+    """
+    height, width = image.shape[:2]
+    return blend_density(image, *haze_density(height, width, rng))
+
+def glare_density(height, width, rng=None):
+    """
+    The low resolution density map and the color of the glare add_glare adds to a height x width image.
+    """
+    rng = get_rng(rng)
+    glare_color = (255, 250, 230)
+    center = (rng.uniform(0, width), rng.uniform(0, height / 2))
+    radius = rng.uniform(0.2, 0.6) * max(height, width)
+    strength = rng.uniform(0.4, 0.8)
+    shape = density_grid(height, width)
+
+    distance = grid_distance(shape, height, width, center)
+    glare = strength * np.exp(-2 * (distance / radius) ** 2)
+    return glare, glare_color
+
+def add_glare(image, rng=None):
+    """
+    Add a bright glare around a random point of the upper half of an RGB uint8 image, in place.
+    """
+    height, width = image.shape[:2]
+    return blend_density(image, *glare_density(height, width, rng))
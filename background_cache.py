@@ -0,0 +1,61 @@
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+
+def load_background(path, size=None):
+    """
+    Decode a background image to an HxWx3 uint8 RGB array, optionally resized to size (width, height).
+    """
+    with Image.open(path) as image:
+        background = image.convert("RGB")
+    if size is not None and background.size != tuple(size):
+        background = background.resize(size)
+    return np.asarray(background)
+
+class BackgroundCache(object):
+    """LRU cache of decoded, RGB-normalized and already resized backgrounds, as HxWx3 uint8 arrays.
+
+    Entries are keyed by (path, size) and the cache keeps at most max_bytes of decoded
+    pixel data, evicting the least recently used backgrounds first.
+    Args:
+        max_bytes (int): byte budget for the decoded pixels, 0 disables caching.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, path, size=None, copy=True):
+        """
+        Return a copy of the background at path resized to size, decoding it only on a cache miss.
+        The copy can be modified freely without touching the cached image. copy=False returns the
+        cached image itself, for callers that copy it anyway, it must not be modified.
+        """
+        key = (path, None if size is None else tuple(size))
+        background = self._entries.get(key)
+        if background is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+            background = load_background(path, size)
+            self._put(key, background)
+        return background.copy() if copy else background
+
+    def _put(self, key, background):
+        if background.nbytes > self.max_bytes:
+            return
+        while self.current_bytes + background.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+        self._entries[key] = background
+        self.current_bytes += background.nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(hits={0}, misses={1}, entries={2}, bytes={3})'.format(
+            self.hits, self.misses, len(self._entries), self.current_bytes)
@@ -1,77 +1,88 @@
-import math
-import random
-from PIL import Image, ImageFilter, ImageDraw, ImageEnhance
+import functools
+import cv2
+from PIL import Image, ImageFilter
 import my_transform
 import numpy as np
+from rng import get_rng
+from color_lut import ColorChain
+
+def apply_color_chain(image, chain):
+    """
+    Apply a ColorChain to a uint8 array in place, or to a copy of a PIL image.
+    """
+    if isinstance(image, np.ndarray):
+        return chain.apply(image)
+    return Image.fromarray(chain.apply(np.array(image)))
 
 def adjust_brightness(image, brightness_factor):
     """
-    Adjust the brightness of the input PIL image.
+    Adjust the brightness of the input image, a PIL image or a uint8 array (adjusted in place).
     The brightness_factor controls the adjustment, where 1.0 is the original image.
     """
-    enhancer = ImageEnhance.Brightness(image)
-    adjusted_image = enhancer.enhance(brightness_factor)
-    return adjusted_image
+    return apply_color_chain(image, ColorChain().brightness(brightness_factor))
 
 def adjust_contrast(image, contrast_factor):
     """
-    Adjust the contrast of the input PIL image.
+    Adjust the contrast of the input image, a PIL image or a uint8 array (adjusted in place).
     The contrast_factor controls the adjustment, where 1.0 is the original image.
     """
-    enhancer = ImageEnhance.Contrast(image)
-    adjusted_image = enhancer.enhance(contrast_factor)
-    return adjusted_image
+    return apply_color_chain(image, ColorChain().contrast(contrast_factor))
 
-def random_rotate(image, min_degree, max_degree):
+def random_rotate(image, min_degree, max_degree, rng=None):
     """
     Randomly rotate the input PIL image by an angle within the specified range.
     """
-    rotation_angle = random.uniform(min_degree, max_degree)
+    rotation_angle = get_rng(rng).uniform(min_degree, max_degree)
     rotated_image = image.rotate(rotation_angle, resample=Image.BICUBIC, expand=True)
     return rotated_image
 
 def remove_transparent_padding(image):
+    """
+    Crop the input PIL image to the bounding box of its non-transparent pixels.
+    """
     # Convert the image to RGBA mode if not already
     if image.mode != 'RGBA':
         image = image.convert('RGBA')
-    
-    # Get the image data as a list of pixels
-    pixels = list(image.getdata())
-    
-    # Calculate the bounding box of non-transparent pixels
-    left, upper, right, lower = image.width, image.height, 0, 0
-    for x, y in [(i % image.width, i // image.width) for i in range(len(pixels))]:
-        if pixels[x + y * image.width][3] > 0:  # Check alpha value
-            left = min(left, x)
-            upper = min(upper, y)
-            right = max(right, x)
-            lower = max(lower, y)
-    
-    # Crop the image to the bounding box
-    cropped_image = image.crop((left, upper, right + 1, lower + 1))
-    
-    return cropped_image
 
-def apply_occlusion(image, occlusion_size):
+    # Bounding box of the non-zero alpha values, found by PIL in one native pass over the alpha plane
+    bbox = image.getchannel('A').getbbox()
+    if bbox is None:
+        # Fully transparent, nothing to crop to
+        return image
+
+    return image.crop(bbox)
+
+def color_jitter(image, brightness=1.0, contrast=1.0, saturation=1.0, hue=0.0):
     """
-    Apply occlusion to the input PIL image.
+    Adjust the brightness, contrast, saturation and hue of the input image (RGB or RGBA, alpha is kept)
+    with lookup tables, see ColorChain. Arrays are adjusted in place. The factors are 1.0 for the original
+    image, hue is a shift in turns of the color wheel, in [-0.5, 0.5].
+    """
+    chain = ColorChain().brightness(brightness).contrast(contrast).saturation(saturation).hue(hue)
+    return apply_color_chain(image, chain)
+
+def apply_occlusion(image, occlusion_size, rng=None):
+    """
+    Apply occlusion to the input image, a PIL image or an HxWxC uint8 array.
     The occlusion_size controls the size of the occlusion region, specified as a tuple (width, height).
+    Arrays are occluded in place, PIL images are copied.
     """
-    width, height = image.size
+    if not isinstance(image, np.ndarray):
+        return Image.fromarray(apply_occlusion(np.array(image), occlusion_size, rng))
+    rng = get_rng(rng)
+    height, width = image.shape[:2]
     occlusion_width, occlusion_height = occlusion_size
 
     # Generate random occlusion coordinates within the image bounds
-    x = random.randint(0, width - occlusion_width)
-    y = random.randint(0, height - occlusion_height)
+    x = int(rng.integers(0, width - occlusion_width + 1))
+    y = int(rng.integers(0, height - occlusion_height + 1))
 
-    # Create an occlusion region of the specified size and fill it with a constant color
-    occlusion = Image.new('RGB', occlusion_size, (0, 0, 0))
-    
-    # Paste the occlusion region onto the image at the generated coordinates
-    occluded_image = image.copy()
-    occluded_image.paste(occlusion, (x, y))
+    # Fill the occlusion region with an opaque constant color
+    image[y:y + occlusion_height, x:x + occlusion_width, :3] = 0
+    if image.shape[2] == 4:
+        image[y:y + occlusion_height, x:x + occlusion_width, 3] = 255
 
-    return occluded_image
+    return image
 
 def add_transparent_padding(image, padding_size):
     # Get the original image size
@@ -102,75 +113,209 @@ def apply_shear(input_image, padding=100, shear_factor=0.2):
     return sheared_img
 
 
+# Remap grids are reused across signs of the same size and (quantized) strength
+REMAP_CACHE_SIZE = 16
+
+def quantize_strength(strength):
+    """
+    Round a distortion strength to 3 significant digits so nearby strengths share a remap grid.
+    """
+    return float(f"{strength:.3g}")
+
+@functools.lru_cache(maxsize=REMAP_CACHE_SIZE)
+def pincushion_grid(width, height, strength):
+    """
+    Flat source pixel index of every output pixel of pincushion_distortion.
+    """
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    dx = x - width / 2
+    dy = y - height / 2
+    r = np.sqrt(dx**2 + dy**2) * strength
+
+    # Same wrap-around and truncation as the per-pixel version, the clip guards float rounding up to width
+    source_x = np.minimum(np.mod(x - dx * r, width).astype(np.int32), width - 1)
+    source_y = np.minimum(np.mod(y - dy * r, height).astype(np.int32), height - 1)
+    index = source_y * width + source_x
+    index.flags.writeable = False
+    return index
+
 def pincushion_distortion(input_image, padding=50, strength=0.1):
     input_image = add_transparent_padding(input_image, padding)
 
     width, height = input_image.size
-    output_image = Image.new("RGBA", (width, height))
-
-    for x in range(width):
-        for y in range(height):
-            dx = x - width / 2
-            dy = y - height / 2
-            distance = math.sqrt(dx**2 + dy**2)
-            r = distance * strength
-
-            source_x = int((x - dx * r) % width)
-            source_y = int((y - dy * r) % height)
+    pixels = np.asarray(input_image).reshape(-1, 4)
+    index = pincushion_grid(width, height, quantize_strength(strength))
 
-            output_image.putpixel((x, y), input_image.getpixel((source_x, source_y)))
+    return Image.fromarray(pixels[index], "RGBA")
 
-    return output_image
+@functools.lru_cache(maxsize=REMAP_CACHE_SIZE)
+def barrel_grid(width, height, distortion_amount):
+    """
+    Flat source pixel index of every output pixel of barrel_distortion,
+    width * height where the source falls outside the overlay.
+    """
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    # Calculate polar coordinates relative to the center
+    dx = x - width / 2
+    dy = y - height / 2
+    distance = np.sqrt(dx**2 + dy**2)
+    angle = np.arctan2(dy, dx)
+
+    # Apply distortion to polar coordinates and convert back to Cartesian, truncating like int()
+    distorted_distance = distance + distortion_amount * distance**2
+    new_x = np.trunc(width / 2 + distorted_distance * np.cos(angle))
+    new_y = np.trunc(height / 2 + distorted_distance * np.sin(angle))
+
+    inside = (0 <= new_x) & (new_x < width) & (0 <= new_y) & (new_y < height)
+    index = np.where(inside, new_y * width + new_x, width * height).astype(np.int32)
+    index.flags.writeable = False
+    return index
 
 def barrel_distortion(overlay, distortion_amount = 0.1):
-    # Define the barrel distortion parameters
-
     # Apply barrel distortion effect to the overlay image
     width, height = overlay.size
-    distorted_overlay = Image.new("RGBA", (width, height))
-    draw = ImageDraw.Draw(distorted_overlay)
-
-    for y in range(height):
-        for x in range(width):
-            # Calculate polar coordinates relative to the center
-            dx = x - width / 2
-            dy = y - height / 2
-            distance = math.sqrt(dx**2 + dy**2)
-            angle = math.atan2(dy, dx)
-
-            # Apply distortion to polar coordinates
-            distorted_distance = distance + distortion_amount * distance**2
-
-            # Convert polar coordinates back to Cartesian
-            new_x = int(width / 2 + distorted_distance * math.cos(angle))
-            new_y = int(height / 2 + distorted_distance * math.sin(angle))
-
-            if 0 <= new_x < width and 0 <= new_y < height:
-                draw.point((x, y), overlay.getpixel((new_x, new_y)))
-    return distorted_overlay
-
-def elastic_transform(overlay):
-    # Elastic Transform
-    preprocess = my_transform.RandomElastic(alpha=2, sigma=0.06)
-    overlay = preprocess(overlay, mask=None)
+    index = barrel_grid(width, height, quantize_strength(distortion_amount))
+
+    # One extra transparent pixel that every out-of-bounds source maps to
+    pixels = np.zeros((width * height + 1, 4), dtype=np.uint8)
+    pixels[:-1] = np.asarray(overlay.convert("RGBA")).reshape(-1, 4)
+
+    return Image.fromarray(pixels[index], "RGBA")
+
+# Number of precomputed elastic displacement fields kept per bank size (see my_transform._bank_side),
+# 0 generates a fresh field for every overlay
+ELASTIC_BANK_SIZE = 0
+# Strength and smoothness of the elastic distortion, relative to the width of the overlay
+ELASTIC_ALPHA = 2
+ELASTIC_SIGMA = 0.06
+
+def elastic_transform(overlay, rng=None):
+    # Elastic Transform, arrays stay arrays
+    if isinstance(overlay, np.ndarray):
+        return my_transform.RandomElastic.elastic_array(overlay, ELASTIC_ALPHA, ELASTIC_SIGMA, rng, ELASTIC_BANK_SIZE)
+    preprocess = my_transform.RandomElastic(alpha=ELASTIC_ALPHA, sigma=ELASTIC_SIGMA, bank_size=ELASTIC_BANK_SIZE)
+    overlay = preprocess(overlay, mask=None, rng=rng)
     return overlay
 
-def add_gaussian_noise(image, mean=0, std=10):
+def elastic_displacement(height, width, rng=None, source_width=None, bank_size=ELASTIC_BANK_SIZE):
     """
-    Add Gaussian noise to the input PIL image.
-    The mean and standard deviation (std) control the distribution of the noise.
+    The 2 x height x width displacement field elastic_transform would use on a height x width overlay.
+    For an overlay shrunk to width from a source_width wide sign, the field elastic_transform would use
+    on the source, scaled down to the overlay: the distortion keeps the same size relative to the sign
+    instead of the same size in pixels. bank_size > 0 draws the field from a bank of precomputed ones.
+    """
+    alpha = ELASTIC_ALPHA if source_width is None else ELASTIC_ALPHA * width / source_width
+    # Overlays are RGBA, the field is as strong as the one elastic_transform blurs across 4 channels
+    return my_transform.RandomElastic.displacement(height, width, alpha, ELASTIC_SIGMA, rng, bank_size, channels=4)
+
+# Side and number of the precomputed standard normal noise tiles used by add_gaussian_noise(use_bank=True)
+NOISE_TILE_SIZE = 128
+NOISE_BANK_SIZE = 8
+# Largest image noised by add_noise_stack at full size, larger ones are cheaper to tile with the scaled bank
+NOISE_STACK_MAX_PIXELS = 3 * NOISE_BANK_SIZE * NOISE_TILE_SIZE ** 2
+
+@functools.lru_cache(maxsize=4)
+def noise_tiles(channels, size=NOISE_TILE_SIZE, count=NOISE_BANK_SIZE):
+    """
+    count x size x size x channels float32 standard normal tiles, the same in every process.
     """
-    np_image = np.array(image)
-    h, w, c = np_image.shape
+    return np.random.default_rng([channels, size, count]).standard_normal((count, size, size, channels), dtype=np.float32)
 
-    # Generate random Gaussian noise with the same shape as the image
-    noise = np.random.normal(mean, std, (h, w, c)).astype(np.uint8)
+@functools.lru_cache(maxsize=4)
+def noise_variants(channels):
+    """
+    The noise tiles and their flipped copies, 4 * NOISE_BANK_SIZE contiguous tiles, tile i flipped vertically
+    and horizontally at index 4 * i + 2 * flip_y + flip_x.
+    """
+    tiles = noise_tiles(channels)
+    return np.stack([tiles[i, ::flip_y, ::flip_x] for i in range(len(tiles)) for flip_y in (1, -1) for flip_x in (1, -1)])
 
-    # Add the noise to the image
-    noisy_image = np.clip(np_image + noise, 0, 255).astype(np.uint8)
+def noise_layout(height, width, rng):
+    """
+    Random placement of the noise tiles over a height x width image: the (offset_y, offset_x) of the grid of
+    tiles and the variant (see noise_variants) of every tile, a rows x columns array.
+    """
+    size = NOISE_TILE_SIZE
+    offset_y, offset_x = (int(offset) for offset in rng.integers(size, size=2))
+    variants = [[int(rng.integers(4 * NOISE_BANK_SIZE)) for _ in range(-offset_x, width, size)]
+                for _ in range(-offset_y, height, size)]
+    return offset_y, offset_x, np.array(variants)
+
+def add_noise_from_bank(np_image, mean, std, rng, layout=None):
+    """
+    Add mean + std * noise to an HxWxC uint8 array in place, tiling it with bank tiles picked,
+    flipped and offset at random (layout, see noise_layout, drawn from rng when None), through
+    add_noise_stack on a stack of one image.
+    """
+    height, width = np_image.shape[:2]
+    layout = layout if layout is not None else noise_layout(height, width, rng)
+    return add_noise_stack(np_image[None], [mean], [std], [layout])[0]
 
+def add_noise_stack(images, means, stds, layouts):
+    """
+    Add means[i] + stds[i] * noise to images[i] of an N x H x W x C uint8 stack in place, the noise laid
+    out by layouts[i] (see noise_layout). The noise of every image is assembled at full size from the
+    tiles, then scaled and added for the whole stack at once, which beats scaling the bank per image as
+    long as the images are not much larger than the bank (NOISE_STACK_MAX_PIXELS). Larger images are
+    tiled with the scaled bank one block at a time, every block added with saturation while it is in cache.
+    """
+    count, height, width, channels = images.shape
+    size = NOISE_TILE_SIZE
+    if height * width > NOISE_STACK_MAX_PIXELS:
+        for image, mean, std, (offset_y, offset_x, choices) in zip(images, means, stds, layouts):
+            # Scale the whole bank once, it is much smaller than a large image, and split it into the
+            # positive and negative parts so the blocks take the fast uint8 saturating add and subtract
+            noise = np.rint(noise_tiles(channels) * np.float32(std) + np.float32(mean))
+            positive = np.clip(noise, 0, 255).astype(np.uint8)
+            negative = np.clip(-noise, 0, 255).astype(np.uint8)
+            # Flipped copies are made contiguous up front, cv2 would copy a flipped view on every call
+            variants = [(np.ascontiguousarray(positive[i, ::flip_y, ::flip_x]), np.ascontiguousarray(negative[i, ::flip_y, ::flip_x]))
+                        for i in range(len(noise)) for flip_y in (1, -1) for flip_x in (1, -1)]
+            for row, y in enumerate(range(-offset_y, height, size)):
+                for column, x in enumerate(range(-offset_x, width, size)):
+                    tile_positive, tile_negative = variants[choices[row, column]]
+                    top, left, bottom, right = max(y, 0), max(x, 0), min(y + size, height), min(x + size, width)
+                    region = image[top:bottom, left:right]
+                    cv2.add(region, tile_positive[top - y:bottom - y, left - x:right - x], dst=region)
+                    cv2.subtract(region, tile_negative[top - y:bottom - y, left - x:right - x], dst=region)
+        return images
+    variants = noise_variants(channels)
+    noise = np.empty(images.shape, dtype=np.float32)
+    for i, (offset_y, offset_x, choices) in enumerate(layouts):
+        for row, y in enumerate(range(-offset_y, height, size)):
+            for column, x in enumerate(range(-offset_x, width, size)):
+                top, left, bottom, right = max(y, 0), max(x, 0), min(y + size, height), min(x + size, width)
+                noise[i, top:bottom, left:right] = variants[choices[row, column], top - y:bottom - y, left - x:right - x]
+    noise *= np.array(stds, dtype=np.float32)[:, None, None, None]
+    noise += np.array(means, dtype=np.float32)[:, None, None, None]
+    np.rint(noise, out=noise)
+    # Whole numbers, so one saturating add matches the saturating add and subtract of the two parts
+    tall = images.reshape(-1, width, channels)
+    cv2.add(tall, noise.reshape(tall.shape), dst=tall, dtype=cv2.CV_8U)
+    return images
+
+def add_gaussian_noise(image, mean=0, std=10, rng=None, use_bank=False):
+    """
+    Add Gaussian noise to the input image, a PIL image or a uint8 array (noised in place).
+    The mean and standard deviation (std) control the distribution of the noise.
+    The noise is float32 and added with saturation, use_bank draws it from precomputed tiles
+    instead of generating it at full image size.
+    """
+    rng = get_rng(rng)
+    np_image = image if isinstance(image, np.ndarray) else np.array(image)
+
+    if use_bank:
+        add_noise_from_bank(np_image, mean, std, rng)
+    else:
+        noise = rng.standard_normal(np_image.shape, dtype=np.float32)
+        noise *= std
+        noise += mean
+        cv2.add(np_image, noise, dst=np_image, dtype=cv2.CV_8U)
+
+    if isinstance(image, np.ndarray):
+        return np_image
     # Convert the noisy image back to PIL image
-    noisy_pil_image = Image.fromarray(noisy_image)
+    noisy_pil_image = Image.fromarray(np_image)
 
     return noisy_pil_image
 
@@ -179,11 +324,12 @@ def are_overlapping(rect1, rect2):
     x2, y2, w2, h2 = rect2
     return not (x1 + w1 < x2 or x2 + w2 < x1 or y1 + h1 < y2 or y2 + h2 < y1)
 
-def generate_non_overlapping_coordinates(existing_coords, width, height, overlay_width, overlay_height):
+def generate_non_overlapping_coordinates(existing_coords, width, height, overlay_width, overlay_height, rng=None):
+    rng = get_rng(rng)
     max_attempts = 100
     for _ in range(max_attempts):
-        x = random.randint(0, width - overlay_width)
-        y = random.randint(0, height - overlay_height)
+        x = int(rng.integers(0, width - overlay_width + 1))
+        y = int(rng.integers(0, height - overlay_height + 1))
         new_rect = (x, y, overlay_width, overlay_height)
         
         is_overlapping = False
@@ -0,0 +1,41 @@
+import os
+import time
+import argparse
+from background_cache import load_background
+from encoders import ImageEncoder
+
+# (format, preset) pairs compared by the benchmark
+CONFIGS = [("png", preset) for preset in ("fast", "balanced", "small")] + [
+    ("jpeg", "balanced"),
+    ("jpeg-cv2", "balanced"),
+    ("webp", "fast"),
+    ("webp", "balanced"),
+    ("webp-lossless", "fast"),
+    ("raw", "balanced")
+]
+
+def main(opt):
+    background_images_list = sorted(f for f in os.listdir(opt.backgrounds_path) if f.endswith(('.png', '.jpg', '.jpeg')))
+    size = (opt.width, opt.height) if opt.resize else None
+    backgrounds = [load_background(os.path.join(opt.backgrounds_path, f), size) for f in background_images_list[:opt.number_of_images]]
+    megapixels = sum(background.shape[0] * background.shape[1] for background in backgrounds) / 1e6
+
+    print(f"{len(backgrounds)} backgrounds, {megapixels:.1f} MP")
+    print("| format | preset | encode ms/image | MP/s | KB/image |")
+    print("|---|---|---|---|---|")
+    for format, preset in CONFIGS:
+        encoder = ImageEncoder(format, preset=preset)
+        start = time.perf_counter()
+        total_bytes = sum(len(encoder(background)) for background in backgrounds)
+        elapsed = time.perf_counter() - start
+        print(f"| {format} | {preset} | {1000 * elapsed / len(backgrounds):.1f} | "
+              f"{megapixels / elapsed:.1f} | {total_bytes / 1024 / len(backgrounds):.0f} |")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare encode time against file size of the output encoders")
+    parser.add_argument("--backgrounds_path", type=str, default="backgrounds", help="path to background images")
+    parser.add_argument("--number_of_images", type=int, default=20, help="number of backgrounds to encode")
+    parser.add_argument("--resize", action="store_true", help="resize the backgrounds before encoding")
+    parser.add_argument("--width", type=int, default=240, help="width that backgrounds will be resized to")
+    parser.add_argument("--height", type=int, default=180, help="height that backgrounds will be resized to")
+    main(parser.parse_args())
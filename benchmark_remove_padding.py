@@ -0,0 +1,47 @@
+import os
+import time
+import argparse
+from PIL import Image
+from basic_augmentation import remove_transparent_padding, add_transparent_padding, random_rotate
+
+def remove_transparent_padding_reference(image):
+    # The previous pure Python implementation, kept to compare speed and results
+    if image.mode != 'RGBA':
+        image = image.convert('RGBA')
+    pixels = list(image.getdata())
+    left, upper, right, lower = image.width, image.height, 0, 0
+    for x, y in [(i % image.width, i // image.width) for i in range(len(pixels))]:
+        if pixels[x + y * image.width][3] > 0:
+            left = min(left, x)
+            upper = min(upper, y)
+            right = max(right, x)
+            lower = max(lower, y)
+    return image.crop((left, upper, right + 1, lower + 1))
+
+def time_call(function, image, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(image)
+    return (time.perf_counter() - start) / repeat, result
+
+def main(opt):
+    sign = Image.open(os.path.join(opt.overlays_path, opt.sign)).convert("RGBA")
+    print("| sign size | padded size | reference ms | vectorized ms | speedup | same crop |")
+    print("|---|---|---|---|---|---|")
+    for scale in opt.scales:
+        overlay = random_rotate(sign.resize((int(sign.width * scale), int(sign.height * scale))), -30, 30)
+        # apply_shear pads an overlay by its own width on every side
+        padded = add_transparent_padding(overlay, overlay.width)
+        reference_time, reference = time_call(remove_transparent_padding_reference, padded, 1)
+        vectorized_time, vectorized = time_call(remove_transparent_padding, padded, opt.repeat)
+        same = reference.size == vectorized.size and reference.tobytes() == vectorized.tobytes()
+        print(f"| {overlay.width}x{overlay.height} | {padded.width}x{padded.height} | {1000 * reference_time:.1f} | "
+              f"{1000 * vectorized_time:.3f} | {reference_time / vectorized_time:.0f}x | {same} |")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmark of remove_transparent_padding on padded signs")
+    parser.add_argument("--overlays_path", type=str, default="signs", help="path to traffic signs overlay images")
+    parser.add_argument("--sign", type=str, default="stop_1.png", help="sign file to benchmark with")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.25, 0.5, 1.0, 2.0], help="sign scales to benchmark")
+    parser.add_argument("--repeat", type=int, default=20, help="repetitions of the vectorized version")
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+import os
+import sys
+import argparse
+import json
+import signal
+import tarfile
+import tempfile
+import multiprocessing
+import main as generator
+
+def run(opt, kill_at=None):
+    if kill_at is not None:
+        # Kill the run without any cleanup right before image kill_at is recorded
+        collect_result = generator.collect_result
+        def collect_or_kill(coco_writer, file_name, *args):
+            if os.path.splitext(file_name)[0] == str(kill_at):
+                os.kill(os.getpid(), signal.SIGKILL)
+            collect_result(coco_writer, file_name, *args)
+        generator.collect_result = collect_or_kill
+    generator.main(opt)
+
+def run_process(opt, kill_at=None):
+    process = multiprocessing.Process(target=run, args=(opt, kill_at))
+    process.start()
+    process.join()
+    return process.exitcode
+
+def output_contents(opt):
+    """
+    The bytes of every output file and of the annotations, shards as the list of their members in order.
+    """
+    contents = {}
+    for name in sorted(os.listdir(opt.images_save_path)):
+        path = os.path.join(opt.images_save_path, name)
+        if name.endswith(".tar"):
+            with tarfile.open(path) as tar:
+                contents[name] = [(member.name, tar.extractfile(member).read()) for member in tar.getmembers()]
+        else:
+            with open(path, "rb") as output_file:
+                contents[name] = output_file.read()
+    with open(os.path.join(opt.annotation_save_path, opt.annotation_filename + ".json")) as coco_json_file:
+        contents["annotations"] = json.load(coco_json_file)
+    return contents
+
+def with_output(opt, output_dir, **changes):
+    return argparse.Namespace(**dict(vars(opt), images_save_path=os.path.join(output_dir, "images"),
+                                     annotation_save_path=os.path.join(output_dir, "annotations"), **changes))
+
+def main(opt):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        reference = with_output(opt, os.path.join(temp_dir, "reference"))
+        interrupted = with_output(opt, os.path.join(temp_dir, "interrupted"))
+        if run_process(reference) != 0:
+            print("The uninterrupted run failed")
+            return 1
+        if run_process(interrupted, opt.kill_at) != -signal.SIGKILL:
+            print(f"The run was not killed at image {opt.kill_at}")
+            return 1
+        if run_process(with_output(interrupted, os.path.join(temp_dir, "interrupted"), resume=True)) != 0:
+            print("The resumed run failed")
+            return 1
+
+        expected, actual = output_contents(reference), output_contents(interrupted)
+        different = sorted(name for name in set(expected) | set(actual) if expected.get(name) != actual.get(name))
+        if different:
+            print(f"Resumed run differs from the uninterrupted one in: {', '.join(different)}")
+            return 1
+        print(f"Resumed run matches the uninterrupted one ({len(expected)} outputs)")
+        return 0
+
+if __name__ == '__main__':
+    # Same options as main.py, run twice in a temporary directory, killed and resumed the second time
+    parser = generator.get_parser()
+    parser.description = "Check that a run killed at --kill_at and resumed writes the same output as an uninterrupted run"
+    parser.add_argument("--kill_at", type=int, default=22, help="index of the image the run is killed at")
+    parser.set_defaults(number_of_images=30, checkpoint_every=5, seed=123, output_mode="shards", shard_size_mb=1)
+    sys.exit(main(parser.parse_args()))
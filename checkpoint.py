@@ -0,0 +1,29 @@
+import os
+import pickle
+
+def save_checkpoint(path, last_index, run_seed, coco_state, output_state=None):
+    """
+    Record that every image up to last_index is finished, together with the run seed
+    (every image's RNG is derived from it) and the COCO writer (and shard writer) snapshots
+    needed to continue the run from there.
+    """
+    checkpoint = {
+        "last_index": last_index,
+        "run_seed": run_seed,
+        "coco_state": coco_state,
+        "output_state": output_state
+    }
+    # Write to a temporary file first so a kill during the save keeps the previous checkpoint intact
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, path)
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint written by save_checkpoint.
+    """
+    with open(path, "rb") as checkpoint_file:
+        return pickle.load(checkpoint_file)
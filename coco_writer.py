@@ -0,0 +1,123 @@
+import os
+import json
+import shutil
+
+class CocoWriter(object):
+    """Stream a COCO dataset to disk with a fixed memory footprint.
+
+    Image and annotation entries are appended to two part files as soon as they are added,
+    close() stitches them together with the categories into the final JSON document.
+    Args:
+        path (str): path of the final COCO JSON file.
+        categories (list of dict): COCO category entries.
+        resume_state (dict): a state() snapshot, the part files of an interrupted run are truncated
+            back to it and appended to instead of starting over.
+    """
+    def __init__(self, path, categories, resume_state=None):
+        self.path = path
+        self.categories = categories
+        self.images_path = path + ".images.part"
+        self.annotations_path = path + ".annotations.part"
+        if resume_state is None:
+            self.num_images = 0
+            self.num_annotations = 0
+            self._images_file = open(self.images_path, "w")
+            self._annotations_file = open(self.annotations_path, "w")
+        else:
+            self.num_images = resume_state["num_images"]
+            self.num_annotations = resume_state["num_annotations"]
+            self._images_file = self._reopen(self.images_path, resume_state["images_offset"])
+            self._annotations_file = self._reopen(self.annotations_path, resume_state["annotations_offset"])
+
+    @staticmethod
+    def _reopen(part_path, offset):
+        # Drop whatever was written after the snapshot and continue from there
+        part = open(part_path, "r+")
+        part.truncate(offset)
+        part.seek(offset)
+        return part
+
+    def add_image(self, file_name, height, width):
+        """
+        Append an image entry and return its id.
+        """
+        image = {
+            "file_name": file_name,
+            "height": height,
+            "width": width,
+            "id": self.num_images
+        }
+        self._write(self._images_file, image, self.num_images)
+        self.num_images += 1
+        return image["id"]
+
+    def add_annotation(self, image_id, category_id, bbox):
+        annotation = {
+            "id": self.num_annotations + 1,
+            "image_id": image_id,
+            "bbox": bbox,  # [x, y, width, height]
+            "area": bbox[2] * bbox[3],
+            "iscrowd": 0,
+            "category_id": category_id,
+            "segmentation": []
+        }
+        self._write(self._annotations_file, annotation, self.num_annotations)
+        self.num_annotations += 1
+
+    @staticmethod
+    def _write(file, entry, count):
+        if count:
+            file.write(",\n")
+        json.dump(entry, file)
+
+    def flush(self):
+        self._images_file.flush()
+        self._annotations_file.flush()
+
+    def state(self):
+        """
+        Sync the part files to disk and return a snapshot that the writer can be resumed from.
+        """
+        self.flush()
+        os.fsync(self._images_file.fileno())
+        os.fsync(self._annotations_file.fileno())
+        return {
+            "num_images": self.num_images,
+            "num_annotations": self.num_annotations,
+            "images_offset": self._images_file.tell(),
+            "annotations_offset": self._annotations_file.tell()
+        }
+
+    def close(self):
+        """
+        Finish the JSON document at self.path and remove the part files.
+        """
+        self._images_file.close()
+        self._annotations_file.close()
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as coco_json_file:
+            coco_json_file.write('{"images": [\n')
+            with open(self.images_path) as part:
+                shutil.copyfileobj(part, coco_json_file)
+            coco_json_file.write('\n], "categories": ')
+            json.dump(self.categories, coco_json_file)
+            coco_json_file.write(', "annotations": [\n')
+            with open(self.annotations_path) as part:
+                shutil.copyfileobj(part, coco_json_file)
+            coco_json_file.write('\n]}')
+        os.replace(temp_path, self.path)
+
+        os.remove(self.images_path)
+        os.remove(self.annotations_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Keep the part files of a failed run, only release the handles
+            self._images_file.close()
+            self._annotations_file.close()
@@ -0,0 +1,182 @@
+import functools
+import cv2
+import numpy as np
+
+# Float parameters are rounded to this step before compiling, so nearby parameters share cached tables
+PARAMETER_BUCKET = 0.005
+COLOR_LUT_CACHE_SIZE = 256
+# ITU-R 601-2 luma weights, as used by PIL's "L" conversion
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+def _bucket(value):
+    return round(round(value / PARAMETER_BUCKET) * PARAMETER_BUCKET, 6)
+
+# Color space of the operations that are not channel-wise, with the conversions to it and back
+COLOR_SPACES = {
+    "lightness": ("hls", cv2.COLOR_RGB2HLS, cv2.COLOR_HLS2RGB),
+    "saturation": ("hsv", cv2.COLOR_RGB2HSV, cv2.COLOR_HSV2RGB),
+    "hue": ("hsv", cv2.COLOR_RGB2HSV, cv2.COLOR_HSV2RGB)
+}
+
+def _color_space(op):
+    return COLOR_SPACES[op[0]][0] if op[0] in COLOR_SPACES else "rgb"
+
+@functools.lru_cache(maxsize=COLOR_LUT_CACHE_SIZE)
+def channel_lut(ops, means, channels):
+    """
+    Compile a run of channel-wise ops into a 256 x 1 x channels uint8 table for cv2.LUT,
+    means are the per-channel means of the image going into the first op (contrast needs them).
+    The channels past the third (alpha) are left unchanged.
+    """
+    curves = np.tile(np.arange(256, dtype=np.float64), (3, 1))
+    means = np.array(means, dtype=np.float64)
+    for op in ops:
+        if op[0] == "brightness":
+            curves = curves * op[1]
+            means = means * op[1]
+        elif op[0] == "contrast":
+            # Like ImageEnhance.Contrast, blend with the mean gray of the image
+            gray = int(LUMA_WEIGHTS @ means + 0.5)
+            curves = gray + (curves - gray) * op[1]
+            means = gray + (means - gray) * op[1]
+        elif op[0] == "blend":
+            color = np.array(op[1], dtype=np.float64)[:, None]
+            curves = curves * (1 - op[2]) + color * op[2]
+            means = means * (1 - op[2]) + color[:, 0] * op[2]
+        curves = np.clip(curves, 0, 255)
+        means = np.clip(means, 0, 255)
+    lut = np.tile(np.arange(256, dtype=np.uint8)[:, None, None], (1, 1, channels))
+    lut[:, 0, :3] = np.rint(curves.T).astype(np.uint8)
+    return lut
+
+@functools.lru_cache(maxsize=COLOR_LUT_CACHE_SIZE)
+def lightness_lut(ops):
+    """
+    Compile a run of HLS lightness ops into a 256 x 1 x 3 uint8 table for cv2.LUT on an HLS image,
+    hue and saturation are left unchanged.
+    """
+    curve = np.arange(256, dtype=np.float64)
+    for _, factor, below in ops:
+        curve = np.where(curve < below, np.clip(curve * factor, 0, 255), curve)
+    lut = np.tile(np.arange(256, dtype=np.uint8)[:, None, None], (1, 1, 3))
+    lut[:, 0, 1] = curve.astype(np.uint8)
+    return lut
+
+@functools.lru_cache(maxsize=COLOR_LUT_CACHE_SIZE)
+def hsv_lut(ops):
+    """
+    Compile a run of saturation and hue ops into a 256 x 1 x 3 uint8 table for cv2.LUT on an HSV image
+    (hue in [0, 180) like cv2), value is left unchanged.
+    """
+    hue = np.arange(256, dtype=np.float64)
+    saturation = np.arange(256, dtype=np.float64)
+    for op in ops:
+        if op[0] == "saturation":
+            saturation = np.clip(saturation * op[1], 0, 255)
+        elif op[0] == "hue":
+            hue[:180] = np.mod(hue[:180] + op[1] * 180, 180)
+    lut = np.tile(np.arange(256, dtype=np.uint8)[:, None, None], (1, 1, 3))
+    lut[:, 0, 0] = np.mod(np.rint(hue), 180).astype(np.uint8)
+    lut[180:, 0, 0] = np.arange(180, 256)
+    lut[:, 0, 1] = np.rint(saturation).astype(np.uint8)
+    return lut
+
+class ColorChain(object):
+    """A chain of per-pixel color operations compiled into lookup tables.
+
+    Consecutive channel-wise operations (brightness, contrast, blending with a color) are folded into a
+    single cv2.LUT pass, consecutive HLS lightness operations into one table on the L channel of a single
+    RGB -> HLS -> RGB round-trip and consecutive saturation and hue operations into one table of a single
+    RGB -> HSV -> RGB round-trip. Compiled tables are cached by parameter bucket, see PARAMETER_BUCKET.
+    e.g. ColorChain().brightness(1.2).contrast(1.2).blend((255, 255, 150), 0.2).apply(image)
+    """
+    def __init__(self):
+        self.ops = []
+
+    def brightness(self, factor):
+        """Scale the colors, like ImageEnhance.Brightness."""
+        self.ops.append(("brightness", _bucket(factor)))
+        return self
+
+    def contrast(self, factor):
+        """Scale the colors around the mean gray of the image, like ImageEnhance.Contrast."""
+        self.ops.append(("contrast", _bucket(factor)))
+        return self
+
+    def blend(self, color, alpha):
+        """Blend with a constant RGB color, like Image.blend with a plain image."""
+        self.ops.append(("blend", tuple(int(c) for c in color), _bucket(alpha)))
+        return self
+
+    def lightness(self, factor, below=256):
+        """Scale the HLS lightness of the pixels whose lightness is below below."""
+        self.ops.append(("lightness", _bucket(factor), int(below)))
+        return self
+
+    def saturation(self, factor):
+        """Scale the HSV saturation, 0 gives a gray image."""
+        self.ops.append(("saturation", _bucket(factor)))
+        return self
+
+    def hue(self, shift):
+        """Rotate the hue by shift turns of the color wheel, in [-0.5, 0.5]."""
+        self.ops.append(("hue", _bucket(shift)))
+        return self
+
+    def _runs(self):
+        run = []
+        for op in self.ops:
+            if run and _color_space(op) != _color_space(run[0]):
+                yield run
+                run = []
+            run.append(op)
+        if run:
+            yield run
+
+    def apply(self, image):
+        """
+        Apply the chain in place to an HxWx3 (RGB) or HxWx4 (RGBA, alpha is kept) uint8 array and return it.
+        """
+        return apply_color_chains(image[None], [self])[0]
+
+def _masked_means(images):
+    # Per-image mean color like cv2.mean, of the visible pixels for RGBA with the alpha as mask
+    return np.array([cv2.mean(image, mask=image[..., 3] if image.shape[2] == 4 else None)[:3] for image in images])
+
+def apply_color_chains(images, chains):
+    """
+    Apply chains[i] in place to images[i] of an N x H x W x C uint8 stack and return the stack.
+
+    Every chain runs its own operations, but the stack is processed one run at a time for all the images
+    at once: the contrast means are computed for the whole stack and the HLS / HSV round-trips convert
+    all the images in a single cvtColor call. ColorChain.apply is this on a stack of one image.
+    """
+    count, height, width, channels = images.shape
+    runs = [list(chain._runs()) for chain in chains]
+    step = 0
+    while True:
+        pending = [i for i in range(count) if step < len(runs[i])]
+        if not pending:
+            return images
+        for color_space in ("rgb", "hls", "hsv"):
+            members = [i for i in pending if _color_space(runs[i][step][0]) == color_space]
+            if not members:
+                continue
+            if color_space == "rgb":
+                means = np.zeros((count, 3))
+                contrast = [i for i in members if any(op[0] == "contrast" for op in runs[i][step])]
+                if contrast:
+                    means[contrast] = _masked_means(images[contrast])
+                for i in members:
+                    lut = channel_lut(tuple(runs[i][step]), tuple(int(m + 0.5) for m in means[i]), channels)
+                    cv2.LUT(images[i], lut, dst=images[i])
+            else:
+                _, to_space, from_space = COLOR_SPACES[runs[members[0]][step][0][0]]
+                # The images as one tall image, a single conversion each way
+                converted = cv2.cvtColor(np.ascontiguousarray(images[members, ..., :3]).reshape(-1, width, 3), to_space)
+                converted = converted.reshape(len(members), height, width, 3)
+                for image, i in zip(converted, members):
+                    run = tuple(runs[i][step])
+                    cv2.LUT(image, lightness_lut(run) if color_space == "hls" else hsv_lut(run), dst=image)
+                images[members, ..., :3] = cv2.cvtColor(converted.reshape(-1, width, 3), from_space).reshape(len(members), height, width, 3)
+        step += 1
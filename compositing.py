@@ -0,0 +1,31 @@
+import cv2
+import numpy as np
+
+def composite(background, overlays):
+    """
+    Blend overlays onto a background in place, each one only inside its own bounding box.
+
+    The overlays are premultiplied, so every pixel of a box is background * (1 - alpha) + color,
+    one saturating multiply and one add on the box region of the background, without any
+    full-frame temporary. Overlays are blended in order and clipped to the background.
+    Args:
+        background (numpy.ndarray): HxWx3 uint8 RGB background, modified in place.
+        overlays (list): (overlay, (x, y)) pairs, overlay an hxwx4 uint8 RGBA array with premultiplied
+            colors (see overlay_batch.warp_overlay(premultiplied=True)) and (x, y) the position of its top left corner.
+    Returns:
+        numpy.ndarray: the background.
+    """
+    height, width = background.shape[:2]
+    for overlay, (x, y) in overlays:
+        overlay_height, overlay_width = overlay.shape[:2]
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + overlay_width, width), min(y + overlay_height, height)
+        if left >= right or top >= bottom:
+            continue
+        overlay = overlay[top - y:bottom - y, left - x:right - x]
+        region = background[top:bottom, left:right]
+
+        transparency = 255 - overlay[..., 3]
+        cv2.multiply(region, cv2.merge([transparency] * 3), dst=region, scale=1 / 255)
+        cv2.add(region, np.ascontiguousarray(overlay[..., :3]), dst=region)
+    return background
@@ -0,0 +1,79 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+# format name -> file extension used for the output images and the COCO file_name
+OUTPUT_FORMATS = {
+    "png": ".png",
+    "jpeg": ".jpg",
+    "jpeg-cv2": ".jpg",
+    "webp": ".webp",
+    "webp-lossless": ".webp",
+    "raw": ".npy"
+}
+
+# preset -> (PNG compress_level, WebP method), trading encode speed against file size
+PRESETS = {
+    "fast": (1, 0),
+    "balanced": (6, 4),
+    "small": (9, 6)
+}
+
+DEFAULT_QUALITY = {
+    "jpeg": 90,
+    "jpeg-cv2": 90,
+    "webp": 85,
+    "webp-lossless": 80
+}
+
+class ImageEncoder(object):
+    """Encode images, HxWxC uint8 RGB(A) arrays or PIL images, to bytes in one of OUTPUT_FORMATS.
+    Args:
+        format (str): output format, a key of OUTPUT_FORMATS.
+        quality (int): quality for the lossy formats (effort for webp-lossless), None uses DEFAULT_QUALITY.
+        compress_level (int): PNG zlib level 0-9, None takes it from the preset.
+        preset (str): speed/size preset, a key of PRESETS.
+    """
+    def __init__(self, format="png", quality=None, compress_level=None, preset="balanced"):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError("format should be one of {}".format(sorted(OUTPUT_FORMATS)))
+        png_level, webp_method = PRESETS[preset]
+        self.format = format
+        self.extension = OUTPUT_FORMATS[format]
+        self.quality = DEFAULT_QUALITY.get(format) if quality is None else quality
+        self.compress_level = png_level if compress_level is None else compress_level
+        self.webp_method = webp_method
+
+    def __call__(self, image):
+        if self.format == "raw":
+            # Uncompressed pixels, the .npy header keeps shape and dtype so np.load can read it back
+            buffer = io.BytesIO()
+            np.save(buffer, np.asarray(image))
+            return buffer.getvalue()
+        if self.format == "jpeg-cv2":
+            # OpenCV's libjpeg(-turbo) encoder, useful where it is faster than the one PIL was built with
+            pixels = np.asarray(image)
+            bgr = cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR if pixels.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+            ok, data = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if not ok:
+                raise RuntimeError("cv2.imencode failed")
+            return data.tobytes()
+
+        # PIL only appears here, at the edge of the pipeline
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        buffer = io.BytesIO()
+        if self.format == "png":
+            image.save(buffer, "PNG", compress_level=self.compress_level)
+        elif self.format == "jpeg":
+            image.convert("RGB").save(buffer, "JPEG", quality=self.quality)
+        elif self.format == "webp":
+            image.save(buffer, "WEBP", quality=self.quality, method=self.webp_method)
+        elif self.format == "webp-lossless":
+            image.save(buffer, "WEBP", lossless=True, quality=self.quality, method=self.webp_method)
+        return buffer.getvalue()
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(format={0}, quality={1}, compress_level={2}, webp_method={3})'.format(
+            self.format, self.quality, self.compress_level, self.webp_method)
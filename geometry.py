@@ -0,0 +1,123 @@
+import math
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# Ranges of the radial distortion strength, relative to the half diagonal of the sign.
+# Negative strengths give a pincushion, positive ones a barrel distortion.
+PINCUSHION_RANGE = (-0.25, -0.05)
+BARREL_RANGE = (0.05, 0.3)
+
+def premultiply(overlay):
+    """
+    float32 copy of an RGBA uint8 overlay with the colors multiplied by alpha, so resampling
+    doesn't bleed the color of transparent pixels into the edges of the sign.
+    """
+    premultiplied = overlay.astype(np.float32)
+    premultiplied[..., :3] *= premultiplied[..., 3:] / 255
+    return premultiplied
+
+def unpremultiply(premultiplied):
+    """
+    Inverse of premultiply, back to RGBA uint8.
+    """
+    alpha = premultiplied[..., 3:]
+    premultiplied[..., :3] = np.divide(premultiplied[..., :3] * 255, alpha, out=np.zeros_like(premultiplied[..., :3]), where=alpha > 0)
+    return np.clip(premultiplied + 0.5, 0, 255).astype(np.uint8)
+
+def downscale_overlay(overlay, size):
+    """
+    Area-average an RGBA uint8 overlay down to size (width, height).
+    """
+    return unpremultiply(cv2.resize(premultiply(overlay), size, interpolation=cv2.INTER_AREA))
+
+def linear_part(angle=0.0, shear=0.0):
+    """
+    Forward 2x2 matrix of a rotation by angle degrees, counter-clockwise like PIL's rotate,
+    followed by the horizontal shear of apply_shear.
+    """
+    theta = math.radians(angle)
+    rotation = np.array([[math.cos(theta), math.sin(theta)],
+                         [-math.sin(theta), math.cos(theta)]])
+    # apply_shear samples x + shear * y, so the content itself moves by -shear * y
+    shear_matrix = np.array([[1.0, -shear],
+                             [0.0, 1.0]])
+    return shear_matrix @ rotation
+
+def alpha_hull(alpha):
+    """
+    Convex hull of the non-transparent pixels as an Nx2 float array of corners, in continuous
+    coordinates (pixel (x, y) covers [x, x + 1) x [y, y + 1)).
+    """
+    points = cv2.findNonZero((alpha > 0).astype(np.uint8))
+    if points is None:
+        height, width = alpha.shape
+        points = np.array([[[0, 0]], [[width - 1, height - 1]]], dtype=np.int32)
+    hull = cv2.convexHull(points).reshape(-1, 2).astype(np.float64)
+    # Take the pixel corners so the outline covers whole pixels
+    corners = np.concatenate([hull, hull + [1, 0], hull + [0, 1], hull + [1, 1]])
+    return cv2.convexHull(corners.astype(np.float32)).reshape(-1, 2).astype(np.float64)
+
+def outline_points(hull, spacing=2.0):
+    """
+    Points along the edges of a convex hull, at most spacing pixels apart.
+    """
+    # Densify the edges, the radial distortion bends them
+    edges = np.roll(hull, -1, axis=0) - hull
+    steps = np.maximum(np.ceil(np.hypot(edges[:, 0], edges[:, 1]) / spacing), 1).astype(int)
+    edge = np.repeat(np.arange(len(hull)), steps)
+    step = np.arange(len(edge)) - np.repeat(np.cumsum(steps) - steps, steps)
+    return hull[edge] + edges[edge] * (step / steps[edge])[:, None]
+
+def radial_forward(offsets, strength, radius):
+    """
+    Where the radial distortion moves points at offsets from its center. The distortion is defined
+    by its inverse, an output point at distance r samples the input at r * (1 + strength * r / radius).
+    """
+    rho = np.hypot(offsets[:, 0], offsets[:, 1])
+    # Solve r * (1 + strength * r / radius) = rho for r
+    discriminant = np.maximum(1 + 4 * strength * rho / radius, 0)
+    r = radius * (np.sqrt(discriminant) - 1) / (2 * strength)
+    ratio = np.divide(r, rho, out=np.ones_like(rho), where=rho > 0)
+    return offsets * ratio[:, None]
+
+# Mapping from the warped plane back to an overlay, see fit_warp()
+WarpFit = namedtuple("WarpFit", ["center", "inverse", "low", "extent", "radial_center", "radial_radius", "radial"])
+
+def fit_warp(outline, center, angle=0.0, shear=0.0, radial=0.0):
+    """
+    Compose rotation, shear and radial distortion around center into a WarpFit, with low and extent
+    the bounding box of the warped outline (points in overlay coordinates, see outline_points()).
+    """
+    linear = linear_part(angle, shear)
+
+    # Outline of the sign after the affine part, centered on the overlay center
+    outline = (outline - center) @ linear.T
+    low, high = outline.min(axis=0), outline.max(axis=0)
+    radial_center = (low + high) / 2
+    radial_radius = max(np.hypot(*(high - low)) / 2, 1e-6)
+    if radial:
+        outline = radial_center + radial_forward(outline - radial_center, radial, radial_radius)
+        low, high = outline.min(axis=0), outline.max(axis=0)
+    extent = np.maximum(high - low, 1e-6)
+    return WarpFit(np.asarray(center, dtype=np.float64), np.linalg.inv(linear), low, extent, radial_center, radial_radius, radial)
+
+def unwarp(fit, points):
+    """
+    Overlay coordinates of Nx2 points of the warped plane. The fields of fit are either the ones of a
+    single fit_warp() or arrays holding the fit of every point (inverse Nx2x2, radial_radius and radial N).
+    """
+    # Written out per coordinate instead of matrix products so every point is computed the same way
+    # whatever the other points, and so transposed (2xN) inputs are read row by row
+    x, y = points[..., 0], points[..., 1]
+    # Back through the radial distortion, then the affine part, into overlay coordinates
+    if np.any(fit.radial):
+        offset_x = x - fit.radial_center[..., 0]
+        offset_y = y - fit.radial_center[..., 1]
+        factor = 1 + fit.radial * np.hypot(offset_x, offset_y) / fit.radial_radius
+        x = fit.radial_center[..., 0] + offset_x * factor
+        y = fit.radial_center[..., 1] + offset_y * factor
+    inverse = fit.inverse
+    source_x = inverse[..., 0, 0] * x + inverse[..., 0, 1] * y + fit.center[..., 0]
+    source_y = inverse[..., 1, 0] * x + inverse[..., 1, 1] * y + fit.center[..., 1]
+    return np.stack([source_x, source_y], axis=-1)
@@ -0,0 +1,140 @@
+import os
+import time
+import queue
+import threading
+
+def write_file_atomic(path, data):
+    """
+    Write data to path through a temporary file, so a partially written file never shows up
+    under the final name. Returns the number of bytes written.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as image_file:
+        image_file.write(data)
+    os.replace(temp_path, path)
+    return len(data)
+
+class FileSink(object):
+    """Store every encoded image as its own file in output_dir."""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def __call__(self, name, data, metadata=None):
+        return write_file_atomic(os.path.join(self.output_dir, name), data)
+
+    def close(self):
+        pass
+
+class ImageWriter(object):
+    """Write-behind stage that encodes and writes finished images on background threads.
+
+    submit() returns as soon as the image is queued, so the next composite can start while the
+    previous one is still being compressed. The queue is bounded, a full queue blocks submit().
+    Images are encoded in parallel but handed to the sink one at a time in submission order, so a
+    shard lists them in the same order whatever thread encoded them.
+    Images that fail to encode or write are recorded in failed and reported by wait(), which raises
+    so the caller never treats them as written.
+    Args:
+        encoder (callable): turns a PIL image into the bytes to write, e.g. an encoders.ImageEncoder.
+        sink (callable): stores the encoded bytes as sink(name, data, metadata), e.g. a FileSink
+            or a shard_writer.ShardWriter, and returns the number of bytes written.
+        num_threads (int): number of encoder/writer threads, 0 writes inline in submit().
+        max_queue (int): maximum number of images waiting to be written.
+    """
+    def __init__(self, encoder, sink, num_threads=2, max_queue=8):
+        self.encoder = encoder
+        self.sink = sink
+        self.num_threads = num_threads
+        self.images_written = 0
+        self.bytes_written = 0
+        self.max_queue_depth = 0
+        self._queue_depth_total = 0
+        self._submitted = 0
+        self.failed = []
+        self._lock = threading.Lock()
+        # Submission number of the next image to hand to the sink
+        self._next_write = 0
+        self._turn = threading.Condition()
+        self._start_time = time.time()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, image, name, metadata=None):
+        order = self._submitted
+        self._submitted += 1
+        if not self._threads:
+            self._write(image, name, metadata, order)
+            return
+        depth = self._queue.qsize()
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self._queue_depth_total += depth
+        self._queue.put((image, name, metadata, order))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                self._write(*item)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image, name, metadata, order):
+        try:
+            data = self.encoder(image)
+        except Exception as e:
+            data = e
+        with self._turn:
+            self._turn.wait_for(lambda: self._next_write == order)
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                nbytes = self.sink(name, data, metadata)
+            except Exception as e:
+                with self._lock:
+                    self.failed.append(name)
+                    print(f"Error in writing {name}: {e}")
+                return
+            finally:
+                # Failed or not, the next image can go
+                self._next_write += 1
+                self._turn.notify_all()
+        with self._lock:
+            self.images_written += 1
+            self.bytes_written += nbytes
+            # Under the lock, the threads would interleave their lines
+            print("Saved", name)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def wait(self):
+        """
+        Block until every submitted image has been written. Raises IOError if some of them could not be
+        written, they must not be recorded as done.
+        """
+        self._queue.join()
+        with self._lock:
+            if self.failed:
+                raise IOError(f"Failed to write {len(self.failed)} images: {', '.join(self.failed[:10])}")
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.sink.close()
+
+    def report(self):
+        elapsed = max(time.time() - self._start_time, 1e-9)
+        average_depth = self._queue_depth_total / max(self._submitted, 1)
+        return (f"Image writer: {self.images_written} images, {self.bytes_written / 1e6:.1f} MB, "
+                f"{self.bytes_written / 1e6 / elapsed:.2f} MB/s, "
+                f"queue depth avg {average_depth:.1f} max {self.max_queue_depth}")
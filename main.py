@@ -1,21 +1,29 @@
-import random
 import os
-import json
 import numpy as np
-from PIL import Image
 from add_rain import *
 from add_sun import *
 from add_snow import *
 from add_fog import *
+from atmosphere import fog_density, haze_density, glare_density
 from basic_augmentation import *
+from background_cache import BackgroundCache
+from sign_library import load_sign_library, level_index
+from color_lut import ColorChain
+from placement import PlacementGrid
+from compositing import composite
+from overlay_batch import OverlayJob, augment_overlays
+from weather import WeatherJob, apply_weather
+from coco_writer import CocoWriter
+from checkpoint import save_checkpoint, load_checkpoint
+from image_writer import ImageWriter, FileSink
+from shard_writer import ShardWriter
+from encoders import ImageEncoder, OUTPUT_FORMATS, PRESETS
+from rng import image_rng, new_run_seed
+from geometry import PINCUSHION_RANGE, BARREL_RANGE
 import argparse
-
-# Create COCO dataset structure
-coco_dataset = {
-    "images": [],
-    "categories": [],
-    "annotations": []
-}
+import multiprocessing
+import multiprocessing.util
+from functools import partial
 
 # Define category IDs for traffic sign categories
 categories_dict = {
@@ -27,196 +35,412 @@ categories_dict = {
     "no_right": 6
 }
 
-def add_annotation(image_id, category_id, bbox):
-    annotation = {
-        "id": len(coco_dataset["annotations"]) + 1,
-        "image_id": image_id,
-        "bbox": bbox,  # [x, y, width, height]
-        "area": bbox[2] * bbox[3],
-        "iscrowd": 0,
-        "category_id": category_id,
-        "segmentation": []
-    }
-    coco_dataset["annotations"].append(annotation)
-
-def add_image(file_name, height, width):
-    image = {
-        "file_name": file_name,
-        "height": height,
-        "width": width,
-        "id": len(coco_dataset["images"])
-    }
-    coco_dataset["images"].append(image)
+# Decoded backgrounds, one cache per process
+background_cache = None
+# Decoded sign overlays, built once by the parent and shared with the workers
+sign_library = None
+# Output encoder and write-behind encoder threads, one of each per process
+image_encoder = None
+image_writer = None
+# Pool workers writing their own files wait for them before returning a chunk, so the parent only ever
+# records and checkpoints images that are on disk
+wait_for_writes = False
 
-def main(opt):
-   
-    # Add category entries to the COCO dataset
+def sample_techniques(rng, techniques, count):
+    """
+    Pick count distinct techniques in random order, like random.sample().
+    """
+    return [techniques[i] for i in rng.permutation(len(techniques))[:count]]
+
+def plan_image(idx, opt, background_images_list, library, cache):
+    """
+    Draw the background, the signs and their positions and the augmentation parameters of image idx.
+    Signs are drawn from library (a SignLibrary) and backgrounds decoded through cache (a BackgroundCache).
+    All randomness comes from image_rng(opt.seed, idx), so the image only depends on the run seed and idx.
+    Returns (rng, background, jobs, positions, annotations): the generator, left where the background
+    augmentations continue from, the HxWx3 uint8 RGB background (the cached image, not to be modified),
+    an OverlayJob and the (x, y) position of every placed sign and the list of (category_id, bbox) annotations.
+    """
+    rng = image_rng(opt.seed, idx)
+    selected_background = background_images_list[rng.integers(len(background_images_list))]
+    number_of_signs = int(rng.integers(opt.min_signs, opt.max_signs + 1))
+    
+    background_path = os.path.join(opt.backgrounds_path, selected_background)
+    # Not copied, render_images copies it into the block of its size
+    background = cache.get(background_path, (opt.width, opt.height) if opt.resize else None, copy=False)
+
+    bg_height, bg_width = background.shape[:2]
+
+    placement = PlacementGrid(bg_width, bg_height)
+    jobs = []
+    positions = []
+    annotations = []
+
+    for i in range(number_of_signs):
+        sign = library.signs[rng.integers(len(library.signs))]
+
+        # Plan the pasted size first and augment the pyramid level closest above it instead of the full-size sign
+        output_size = int(rng.integers(int(bg_width / 12), int(bg_width / 4) + 1))
+
+        # The warped sign is output_size x output_size, so its position is known before augmenting it
+        new_coordinates = placement.place(output_size, output_size, rng)
+        if new_coordinates is None:
+            continue
+        placement.add(new_coordinates)
+
+        level = level_index(sign.pyramid, output_size)
+        overlay_height, overlay_width = sign.pyramid[level].shape[:2]
+
+        # Apply common augmentation techniques, the color ones are collected into one color chain
+        # and the geometric ones into one warp, both applied by augment_overlays
+        common_techniques = ['adjust_brightness', 'adjust_contrast', 'color_jitter', 'random_rotate', 'apply_occlusion', 'apply_shear']
+        chosen_common_techniques = sample_techniques(rng, common_techniques, int(rng.integers(0, len(common_techniques) + 1)))
+        color_chain = ColorChain()
+        angle, shear, radial = 0.0, 0.0, 0.0
+        occlusion_size = None
+
+        for technique in chosen_common_techniques:
+            if technique == 'adjust_brightness':
+                color_chain.brightness(rng.uniform(0.4, 1.6))
+            elif technique == 'adjust_contrast':
+                color_chain.contrast(rng.uniform(0.4, 1.6))
+            elif technique == 'color_jitter':
+                color_chain.brightness(rng.uniform(0.7, 1.3)).contrast(rng.uniform(0.7, 1.3))
+                color_chain.saturation(rng.uniform(0.5, 1.5)).hue(rng.uniform(-0.05, 0.05))
+            elif technique == 'random_rotate':
+                angle = rng.uniform(-30, 30)
+            elif technique == 'apply_shear':
+                shear = rng.uniform(-0.5, 0.5)
+            elif technique == 'apply_occlusion':
+                occlusion_size = (int(rng.integers(int(overlay_width / 8), int(overlay_width / 3) + 1)), int(rng.integers(int(overlay_height / 8), int(overlay_height / 3) + 1)))
+
+        occlusion = None
+        if occlusion_size is not None:
+            # Random occlusion position within the level, like apply_occlusion
+            occlusion = (int(rng.integers(0, overlay_width - occlusion_size[0] + 1)),
+                         int(rng.integers(0, overlay_height - occlusion_size[1] + 1))) + occlusion_size
+
+        # Apply distortion techniques
+        distortion_techniques = ['elastic', 'pincushion', 'barrel']
+        chosen_distortion_techniques = sample_techniques(rng, distortion_techniques, int(rng.integers(0, 2)))
+
+        if 'pincushion' in chosen_distortion_techniques:
+            radial = rng.uniform(*PINCUSHION_RANGE)
+        elif 'barrel' in chosen_distortion_techniques:
+            radial = rng.uniform(*BARREL_RANGE)
+        elastic = None
+        if 'elastic' in chosen_distortion_techniques:
+            # Sized for the full-size sign like before the resize, not for the few pixels of the output
+            elastic = elastic_displacement(output_size, output_size, rng, sign.image.shape[1], opt.elastic_bank)
+
+        jobs.append(OverlayJob(sign.pyramid[level], sign.hulls[level], output_size, color_chain, occlusion, angle, shear, radial, elastic))
+        positions.append(new_coordinates[:2])
+
+        bbox = [new_coordinates[0], new_coordinates[1], output_size, output_size]
+        annotations.append((sign.category_id, bbox))
+
+    if len(annotations) < number_of_signs:
+        print(f"Image {idx}: no room left for {number_of_signs - len(annotations)} of {number_of_signs} signs")
+
+    return rng, background, jobs, positions, annotations
+
+def plan_background(background, rng):
+    """
+    Draw one random background augmentation technique of an HxWx3 uint8 RGB background and its parameters.
+    Returns a WeatherJob for apply_weather, or None when the technique could not be planned.
+    """
+    bg_height, bg_width = background.shape[:2]
+    background_techniques = ['adjust_brightness', 'adjust_contrast', 'add_gaussian_noise', 'add_rain', 'add_sun', 'add_snow', 'add_fog', 'add_haze', 'add_glare']
+    technique, = sample_techniques(rng, background_techniques, 1)
+
+    try:
+        if technique == 'adjust_brightness':
+            return WeatherJob(technique, chain=ColorChain().brightness(rng.uniform(0.4, 1.6)))
+        elif technique == 'adjust_contrast':
+            return WeatherJob(technique, chain=ColorChain().contrast(rng.uniform(0.4, 1.6)))
+        elif technique == 'add_gaussian_noise':
+            mean, std = rng.uniform(0, 1), rng.uniform(0, 1)
+            return WeatherJob(technique, noise=(mean, std, noise_layout(bg_height, bg_width, rng)))
+        elif technique == 'add_rain':
+            streaks = rain_streaks(bg_height, bg_width, int(rng.integers(5, int(bg_height/14) + 1)), rng)
+            darken, drop_color = rain_darkening()
+            return WeatherJob(technique, chain=darken, streaks=(streaks, drop_color))
+        elif technique == 'add_sun':
+            return WeatherJob(technique, chain=sunny_chain(rng=rng))
+        elif technique == 'add_snow':
+            return WeatherJob(technique, chain=snow_chain())
+        elif technique == 'add_fog':
+            return WeatherJob(technique, density=fog_density(bg_height, bg_width, rng=rng))
+        elif technique == 'add_haze':
+            return WeatherJob(technique, density=haze_density(bg_height, bg_width, rng))
+        elif technique == 'add_glare':
+            return WeatherJob(technique, density=glare_density(bg_height, bg_width, rng))
+    except Exception as e:
+        print(f"Error in {technique}: {e}")
+    return None
+
+def render_images(indices, opt, background_images_list, library, cache):
+    """
+    Render a chunk of images, see plan_image() for the arguments. The signs of all the images are augmented
+    in one batch by augment_overlays and the backgrounds of the same size in one block by apply_weather,
+    each with its own parameters, so an image is the same whatever chunk it is rendered in. The image is an
+    HxWx3 uint8 RGB array from decode to encode.
+    Returns an (image, annotations) pair per index, annotations a list of (category_id, bbox).
+    """
+    plans = [plan_image(idx, opt, background_images_list, library, cache) for idx in indices]
+    augmented = iter(augment_overlays([job for _, _, jobs, _, _ in plans for job in jobs]))
+    overlays = [[(next(augmented), position) for position in positions] for _, _, _, positions, _ in plans]
+    weather = [plan_background(background, rng) for rng, background, _, _, _ in plans]
+
+    # Backgrounds of the same size are copied into one block, ordered by their background technique so the
+    # images of a technique are a contiguous run of the block
+    blocks = {}
+    for i, (_, background, _, _, _) in enumerate(plans):
+        blocks.setdefault(background.shape, []).append(i)
+    images = [None] * len(plans)
+    for members in blocks.values():
+        members.sort(key=lambda i: "" if weather[i] is None else weather[i].technique)
+        block = np.stack([plans[i][1] for i in members])
+        for i, image in zip(members, block):
+            # Blend all the signs at once, each inside its own box of the background
+            composite(image, overlays[i])
+            images[i] = image
+        apply_weather(block, [weather[i] for i in members])
+    return [(image, annotations) for image, (_, _, _, _, annotations) in zip(images, plans)]
+
+def generate_images(indices, opt, background_images_list):
+    """
+    Render a chunk of images (see render_images) and queue them to be saved to opt.images_save_path.
+    Returns, for every index, (file_name, height, width, annotations) so the caller can record it in the
+    COCO dataset, followed by the background cache statistics of the process that rendered it and the
+    encoded sample when the caller has to store it itself (shard output from a pool worker), else None.
+    """
+    results = []
+    for idx, (background, annotations) in zip(indices, render_images(indices, opt, background_images_list, sign_library, background_cache)):
+        file_name = f"{idx}{image_encoder.extension}"
+        metadata = None
+        if opt.output_mode == "shards":
+            # Per-image annotations stored next to the image in the shard
+            metadata = {
+                "id": idx,
+                "file_name": file_name,
+                "height": background.shape[0],
+                "width": background.shape[1],
+                "annotations": [{"category_id": category_id, "bbox": bbox} for category_id, bbox in annotations]
+            }
+
+        sample = None
+        if image_writer is not None:
+            image_writer.submit(background, file_name, metadata)
+        else:
+            sample = (image_encoder(background), metadata)
+        cache_stats = (os.getpid(), background_cache.hits, background_cache.misses)
+        results.append(((file_name, background.shape[0], background.shape[1], annotations), cache_stats, sample))
+    if wait_for_writes:
+        # Raises if an image of the chunk could not be written
+        image_writer.wait()
+    return results
+
+def collect_result(coco_writer, file_name, height, width, annotations):
+    image_id = coco_writer.add_image(file_name, height, width)
+    for category_id, bbox in annotations:
+        coco_writer.add_annotation(image_id, category_id, bbox)
+    coco_writer.flush()
+
+def init_background_cache(opt):
+    global background_cache
+    background_cache = BackgroundCache(opt.background_cache_mb * 1024 * 1024)
+
+def init_image_writer(opt, sink=None):
+    """
+    Set up the encoder of this process, and the write-behind writer when sink is given.
+    """
+    global image_encoder, image_writer
+    image_encoder = ImageEncoder(opt.format, opt.quality, opt.compress_level, opt.preset)
+    if sink is not None:
+        image_writer = ImageWriter(image_encoder, sink, opt.writer_threads, opt.writer_queue)
+
+def close_image_writer():
+    image_writer.close()
+    print(image_writer.report())
+
+def init_worker(opt, library):
+    global sign_library, wait_for_writes
+    sign_library = library
+    init_background_cache(opt)
+    if opt.output_mode == "shards":
+        # Shards are appended by the parent in index order, workers only encode
+        init_image_writer(opt)
+    else:
+        init_image_writer(opt, FileSink(opt.images_save_path))
+        wait_for_writes = True
+        # Drain the write queue when the pool shuts the worker down, its threads are daemons
+        multiprocessing.util.Finalize(None, close_image_writer, exitpriority=10)
+    # One process per core already, stop OpenCV from spawning its own thread pool in every worker
+    cv2.setNumThreads(1)
+
+def build_categories():
+    categories = []
     for key in categories_dict:
         category = {
             "supercategory": "trafficsign",
             "id": categories_dict[key],
             "name": key
         }
-        coco_dataset['categories'].append(category)
+        categories.append(category)
+    return categories
+
+def list_backgrounds(backgrounds_path):
+    return sorted(f for f in os.listdir(backgrounds_path) if f.endswith(('.png', '.jpg', '.jpeg')))
 
-    folder_A = opt.overlays_path
-    folder_B = opt.backgrounds_path
+def main(opt):
+    global sign_library
     output_folder = opt.images_save_path
 
-    overlay_images_list = [f for f in os.listdir(folder_A) if f.endswith(('.png', '.jpg', '.jpeg'))]
-    background_images_list = [f for f in os.listdir(folder_B) if f.endswith(('.png', '.jpg', '.jpeg'))]
+    sign_library = load_sign_library(opt.overlays_path, categories_dict, opt.sign_manifest)
+    background_images_list = list_backgrounds(opt.backgrounds_path)
 
-    if not overlay_images_list or not background_images_list:
+    if not sign_library.signs or not background_images_list:
         print("No images found in the specified folders.")
         return
 
-    number_of_outputs = opt.number_of_images
+    if not 0 <= opt.min_signs <= opt.max_signs:
+        print("--min_signs must be between 0 and --max_signs.")
+        return
+
+    if opt.overlay_batch < 1:
+        print("--overlay_batch must be at least 1.")
+        return
+
+    os.makedirs(output_folder, exist_ok=True)
 
-    for idx in range(number_of_outputs):
-        selected_background = random.choice(background_images_list)
-        number_of_signs = random.randint(1, 3)
-        os.makedirs(output_folder, exist_ok=True)
-        
-        background_path = os.path.join(folder_B, selected_background)
-        background = Image.open(background_path)
-        
-        if opt.resize:
-            background = background.resize((opt.width, opt.height))
-            
-        bg_width, bg_height = background.size
-
-        existing_coords = []
-
-        for i in range(number_of_signs):
-            selected_overlay = random.choice(overlay_images_list)
-            overlay_path = os.path.join(folder_A, selected_overlay)
-            overlay = Image.open(overlay_path).convert("RGBA")
-            overlay_width, overlay_height = overlay.size
-
-            # Apply common augmentation techniques
-            common_techniques = ['adjust_brightness', 'adjust_contrast', 'random_rotate', 'apply_occlusion', 'apply_shear']
-            chosen_common_techniques = random.sample(common_techniques, random.randint(0, 5))
-
-            for technique in chosen_common_techniques:
-                try:
-                    if technique == 'adjust_brightness':
-                        overlay = adjust_brightness(overlay, random.uniform(0.4, 1.6))
-                    elif technique == 'adjust_contrast':
-                        overlay = adjust_contrast(overlay, random.uniform(0.4, 1.6))
-                    elif technique == 'random_rotate':
-                        overlay = random_rotate(overlay, -30, 30)
-                    elif technique == 'apply_shear':
-                        overlay = apply_shear(overlay, padding=overlay_width, shear_factor=random.uniform(-0.5, 0.5))
-                    elif technique == 'apply_occlusion':
-                        overlay = apply_occlusion(overlay, occlusion_size=(random.randint(int(overlay_width / 8), int(overlay_width / 3)), random.randint(int(overlay_height / 8), int(overlay_height / 3))))
-                    overlay = remove_transparent_padding(overlay)
-                except Exception as e:
-                    print(f"Error in {technique}: {e}")
-
-            # Apply distortion techniques
-            distortion_techniques = ['elastic', 'pincushion', 'barrel']
-            chosen_distortion_techniques = random.sample(distortion_techniques, random.randint(0, 1))
-
-            for technique in chosen_distortion_techniques:
-                try:
-                    if technique == 'pincushion':
-                        overlay = pincushion_distortion(overlay, padding=overlay_width, strength=random.uniform(0.001, 0.0016))
-                    elif technique == 'barrel':
-                        overlay = barrel_distortion(overlay, distortion_amount=random.uniform(0.001, 0.3))
-                    elif technique == 'elastic':
-                        overlay = elastic_transform(overlay)
-                    overlay = remove_transparent_padding(overlay)
-                except Exception as e:
-                    print(f"Error in {technique}: {e}")
-
-            output_size = random.randint(int(bg_width / 12), int(bg_width / 4))
-            overlay = overlay.resize((output_size, output_size))
-            overlay_width, overlay_height = overlay.size
-
-            # Generate non-overlapping coordinates
-            new_coordinates = generate_non_overlapping_coordinates(existing_coords, bg_width, bg_height, overlay_width, overlay_height)
-
-            while new_coordinates is None:
-                new_coordinates = generate_non_overlapping_coordinates(existing_coords, bg_width, bg_height, overlay_width, overlay_height)
-
-            existing_coords.append(new_coordinates)
-
-            output_path = os.path.join(output_folder, f"{idx}_{i}.png")
-            background.paste(overlay, new_coordinates[:2], overlay)
-
-            image_id = len(coco_dataset["images"])
-            temp = overlay_path.split("_")
-            if len(temp) == 3:
-                category_name = temp[0].split("/")[1] + "_" + temp[1]
-            else:
-                category_name = temp[0].split("/")[1]
-            category_id = categories_dict[category_name]
-            bbox = [new_coordinates[0], new_coordinates[1], overlay_width, overlay_height]
-
-            add_annotation(image_id, category_id, bbox)
-
-        # Apply background augmentation techniques
-        background_techniques = ['adjust_brightness', 'adjust_contrast', 'add_gaussian_noise', 'add_rain', 'add_sun', 'add_snow', 'add_fog']
-        chosen_background_techniques = random.sample(background_techniques, 1)
-
-        for technique in chosen_background_techniques:
-            try:
-                if technique == 'adjust_brightness':
-                    background = adjust_brightness(background, random.uniform(0.4, 1.6))
-                elif technique == 'adjust_contrast':
-                    background = adjust_contrast(background, random.uniform(0.4, 1.6))
-                elif technique == 'add_gaussian_noise':
-                    background = add_gaussian_noise(background, mean=random.uniform(0, 1), std=random.uniform(0, 1))
-                elif technique == 'add_rain':
-                    np_image = np.array(background)
-                    np_image_copy = np_image.copy()
-                    np_result = add_rain(np_image_copy, drop_length = random.randint(5, int(background.height/14)))
-                    background = Image.fromarray(np_result)
-                elif technique == 'add_sun':
-                    background = apply_sunny_effect(background)
-                elif technique == 'add_snow':
-                    np_image = np.array(background)
-                    np_image_copy = np_image.copy()
-                    np_result = add_snow(np_image_copy)
-                    background = Image.fromarray(np_result)
-                elif technique == 'add_fog':
-                    np_image = np.array(background.convert("RGB"))
-                    np_image_copy = np_image.copy()
-                    np_result = add_fog(np_image_copy)
-                    background = Image.fromarray(np_result)
-            except Exception as e:
-                print(f"Error in {technique}: {e}")
-
-        output_path = os.path.join(output_folder, f"{idx}.png")
-        background.save(output_path, "PNG")
-        add_image(f"{idx}.png", background.height, background.width)
-        print("Saved", output_path)
-
-    # Save COCO JSON file
     if not os.path.exists(opt.annotation_save_path):
         os.makedirs(opt.annotation_save_path)
         print(f"Directory '{opt.annotation_save_path}' created.")
     else:
         print(f"Directory '{opt.annotation_save_path}' already exists.")
 
+    # Annotations are streamed to disk as images finish instead of being held in memory
     coco_json_path = os.path.join(opt.annotation_save_path, opt.annotation_filename + ".json")
-    with open(coco_json_path, "w") as coco_json_file:
-        json.dump(coco_dataset, coco_json_file)
+    checkpoint_path = coco_json_path + ".checkpoint"
+    start_idx = 0
+    coco_state = None
+    output_state = None
+    if opt.resume and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        start_idx = checkpoint["last_index"] + 1
+        coco_state = checkpoint["coco_state"]
+        output_state = checkpoint["output_state"]
+        opt.seed = checkpoint["run_seed"]
+        print(f"Resuming from image {start_idx}")
+    elif opt.resume:
+        print(f"No checkpoint found at {checkpoint_path}, starting from scratch")
+    if opt.seed is None:
+        opt.seed = new_run_seed()
+    print(f"Run seed: {opt.seed}")
+    coco_writer = CocoWriter(coco_json_path, build_categories(), coco_state)
+
+    if opt.output_mode == "shards":
+        sink = ShardWriter(output_folder, opt.shard_size_mb * 1024 * 1024, output_state)
+    else:
+        sink = FileSink(output_folder)
+
+    init_background_cache(opt)
+    worker_cache_stats = {}
+    generate = partial(generate_images, opt=opt, background_images_list=background_images_list)
+
+    with coco_writer:
+        run_generation(opt, generate, coco_writer, sink, worker_cache_stats, start_idx, checkpoint_path)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    cache_hits = sum(hits for hits, _ in worker_cache_stats.values())
+    cache_misses = sum(misses for _, misses in worker_cache_stats.values())
+    print(f"Background cache: {cache_hits} hits, {cache_misses} misses")
     print("Done !!!")
 
-if __name__ == '__main__':
+def run_generation(opt, generate, coco_writer, sink, worker_cache_stats, start_idx, checkpoint_path):
+    number_of_outputs = opt.number_of_images
+    indices = range(start_idx, number_of_outputs)
+    # Images are rendered in chunks, the signs of a chunk are augmented in one batch
+    chunks = [indices[start:start + opt.overlay_batch] for start in range(0, len(indices), opt.overlay_batch)]
+
+    def finish(chunk, results):
+        for result, stats, sample in results:
+            pid, hits, misses = stats
+            if sample is not None:
+                sink(result[0], *sample)
+                print("Saved", result[0])
+            collect_result(coco_writer, *result)
+            worker_cache_stats[pid] = (hits, misses)
+        # Checkpoint at the end of the chunk that reaches a multiple of checkpoint_every: the whole chunk is
+        # already submitted to the writer, so the shard state would include images past an earlier index
+        if opt.checkpoint_every > 0 and (chunk[-1] + 1) // opt.checkpoint_every > chunk[0] // opt.checkpoint_every:
+            # Only checkpoint images that are fully on disk, pool workers return their images once written
+            if image_writer is not None:
+                image_writer.wait()
+            output_state = sink.state() if opt.output_mode == "shards" else None
+            save_checkpoint(checkpoint_path, chunk[-1], opt.seed, coco_writer.state(), output_state)
+
+    if opt.workers > 1:
+        # Small chunks keep the workers balanced, large enough ones keep IPC overhead low
+        chunksize = max(1, len(chunks) // (opt.workers * 16))
+        pool = multiprocessing.Pool(opt.workers, initializer=init_worker, initargs=(opt, sign_library))
+        try:
+            # imap yields results in index order, so ids match a serial run
+            for chunk, results in zip(chunks, pool.imap(generate, chunks, chunksize=chunksize)):
+                finish(chunk, results)
+            # close/join instead of terminate so the workers can drain their write queues
+            pool.close()
+            pool.join()
+        except BaseException:
+            pool.terminate()
+            raise
+        sink.close()
+    else:
+        init_image_writer(opt, sink)
+        try:
+            for chunk in chunks:
+                finish(chunk, generate(chunk))
+            # Fail the run rather than finish the annotations of images that were not written
+            image_writer.wait()
+        finally:
+            close_image_writer()
+
+def get_parser():
     parser = argparse.ArgumentParser(description="Traffic Sign COCO dataset generator")
     parser.add_argument("--resize", action="store_true", help="resize the image or not")
     parser.add_argument("--width", type=int, default=240, help="width that result images will be resized to")
     parser.add_argument("--height", type=int, default=180, help="height that result image will be resized to")
     parser.add_argument("--number_of_images", type=int, default=100, help="number of images the code will generate")
     parser.add_argument("--overlays_path", type=str, default="signs", help="path to traffic signs overlay images that will be added to backgrounds")
+    parser.add_argument("--sign_manifest", type=str, default=None, help="path to the decoded sign library manifest, defaults to <overlays_path>/.sign_library.npz")
+    parser.add_argument("--min_signs", type=int, default=1, help="minimum number of signs per image")
+    parser.add_argument("--max_signs", type=int, default=3, help="maximum number of signs per image, signs that no longer fit are skipped")
+    parser.add_argument("--overlay_batch", type=int, default=8, help="number of images whose signs are augmented together in one batch")
+    parser.add_argument("--elastic_bank", type=int, default=0, help="number of precomputed elastic fields kept per size, 0 generates a fresh field for every sign")
     parser.add_argument("--backgrounds_path", type=str, default="backgrounds", help="path to background images")
     parser.add_argument("--images_save_path", type=str, default="output/images", help="path to save images")
     parser.add_argument("--annotation_save_path", type=str, default="output/annotations", help="path to annotation JSON file")
     parser.add_argument("--annotation_filename", type=str, default="annotation", help="path to annotation JSON file")
-    
-    opt = parser.parse_args()
+    parser.add_argument("--background_cache_mb", type=int, default=512, help="memory budget in MB for decoded backgrounds, 0 disables the cache")
+    parser.add_argument("--checkpoint_every", type=int, default=100, help="save a checkpoint every N images, 0 disables checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run from its last checkpoint")
+    parser.add_argument("--format", type=str, default="png", choices=sorted(OUTPUT_FORMATS), help="output image format")
+    parser.add_argument("--quality", type=int, default=None, help="quality of the lossy formats (effort for webp-lossless)")
+    parser.add_argument("--compress-level", "--compress_level", dest="compress_level", type=int, default=None, help="PNG compression level 0-9, overrides the preset")
+    parser.add_argument("--preset", type=str, default="balanced", choices=sorted(PRESETS), help="encoder speed/size trade-off")
+    parser.add_argument("--output_mode", type=str, default="files", choices=["files", "shards"], help="write one file per image, or pack images and per-image annotation JSON into tar shards")
+    parser.add_argument("--shard_size_mb", type=int, default=1024, help="size at which a new tar shard is started")
+    parser.add_argument("--writer_threads", type=int, default=2, help="threads that encode and write output images in the background, 0 writes inline")
+    parser.add_argument("--writer_queue", type=int, default=8, help="maximum number of finished images waiting to be written")
+    parser.add_argument("--seed", type=int, default=None, help="run seed, every image's randomness is derived from (seed, image index); random when not given")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes used to render images in parallel")
+    return parser
+
+if __name__ == '__main__':
+    opt = get_parser().parse_args()
     if not os.path.exists(opt.images_save_path):
         os.makedirs(opt.annotation_save_path)
         print(f"Directory '{opt.images_save_path}' created.")
@@ -12,6 +12,7 @@ import numbers
 import types
 import collections
 import warnings
+import functools
 
 from PIL import Image, ImageFilter
 from skimage import color
@@ -1456,6 +1457,29 @@ class RandomAffineCV2(object):
         return self.__class__.__name__ + '(alpha value={0})'.format(self.alpha)
 
 
+def _elastic_field(height, width, sigma, rng):
+    """One 2D float32 displacement field (dx, dy) of shape 2xHxW for unit alpha, shared by all channels."""
+    noise = rng.random((2, height, width), dtype=np.float32) * 2 - 1
+    return np.stack([cv2.GaussianBlur(component, (0, 0), sigma, borderType=cv2.BORDER_REFLECT) for component in noise])
+
+
+# Banked fields are kept for a few fixed sides, powers of sqrt(2), and resampled to the size asked for.
+# Images with a side above ELASTIC_BANK_MAX_SIDE always take fresh fields, a bank of them would take too much memory
+ELASTIC_BANK_MAX_SIDE = 512
+
+
+def _bank_side(side):
+    """The fixed bank side closest to side."""
+    return max(1, int(round(2 ** (round(2 * math.log2(side)) / 2))))
+
+
+@functools.lru_cache(maxsize=16)
+def _elastic_field_bank(height, width, sigma, size):
+    """size precomputed unit-alpha fields of one bank size (see _bank_side), the same in every process."""
+    rng = np.random.default_rng([height, width, size])
+    return [_elastic_field(height, width, sigma, rng) for _ in range(size)]
+
+
 class RandomElastic(object):
     """Random Elastic transformation by CV2 method on image by alpha, sigma parameter.
         # you can refer to:  https://blog.csdn.net/qq_27261889/article/details/80720359
@@ -1467,41 +1491,65 @@ class RandomElastic(object):
         if alpha is 1, output only depends on sigma parameter;
         if alpha < 1 or > 1, it zoom in or out the sigma's Relevant dx, dy.
         sigma (float): sigma value for Elastic transformation, should be \ in (0.05,0.1)
+        bank_size (int): if > 0, draw the displacement fields from a bank of bank_size precomputed
+        fields per bank size (resampled, with random sign flips) instead of generating a new one every call.
         mask (PIL Image) in __call__, if not assign, set None.
+        rng (numpy.random.Generator) in __call__, if not assign, drawn from np.random.
     """
-    def __init__(self, alpha, sigma):
+    def __init__(self, alpha, sigma, bank_size=0):
         assert isinstance(alpha, numbers.Number) and isinstance(sigma, numbers.Number), \
             "alpha and sigma should be a single number."
         assert 0.05 <= sigma <= 0.1, \
             "In pathological image, sigma should be in (0.05,0.1)"
         self.alpha = alpha
         self.sigma = sigma
+        self.bank_size = bank_size
 
     @staticmethod
-    def RandomElasticCV2(img, alpha, sigma, mask=None):
-        alpha = img.shape[1] * alpha
-        sigma = img.shape[1] * sigma
+    def RandomElasticCV2(img, alpha, sigma, mask=None, rng=None, bank_size=0):
         if mask is not None:
             mask = np.array(mask).astype(np.uint8)
             img = np.concatenate((img, mask[..., None]), axis=2)
-
-        shape = img.shape
-
-        dx = gaussian_filter((np.random.rand(*shape) * 2 - 1), sigma) * alpha
-        dy = gaussian_filter((np.random.rand(*shape) * 2 - 1), sigma) * alpha
-        # dz = np.zeros_like(dx)
-
-        x, y, z = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]), np.arange(shape[2]))
-        indices = np.reshape(y + dy, (-1, 1)), np.reshape(x + dx, (-1, 1)), np.reshape(z, (-1, 1))
-
-        img = map_coordinates(img, indices, order=0, mode='reflect').reshape(shape)
+        img = RandomElastic.elastic_array(img, alpha, sigma, rng, bank_size)
         if mask is not None:
-            return Image.fromarray(img[..., :3]), Image.fromarray(img[..., 3])
+            return Image.fromarray(img[..., :-1]), Image.fromarray(img[..., -1])
         else:
             return Image.fromarray(img)
 
-    def __call__(self, img, mask=None):
-        return self.RandomElasticCV2(np.array(img), self.alpha, self.sigma, mask)
+    @staticmethod
+    def displacement(height, width, alpha, sigma, rng=None, bank_size=0, channels=1):
+        """2xHxW float32 displacement field (dx, dy) of elastic_array for a height x width x channels image."""
+        # The 3D noise of the original transform was blurred across the channels too, which averages them
+        # for any sigma above a pixel: scale the shared 2D field down to the same strength
+        alpha = width * alpha / math.sqrt(channels)
+
+        if rng is None:
+            rng = np.random.default_rng(np.random.randint(2**31))
+        if bank_size > 0 and max(height, width) <= ELASTIC_BANK_MAX_SIDE:
+            bank_height, bank_width = _bank_side(height), _bank_side(width)
+            field = _elastic_field_bank(bank_height, bank_width, bank_width * sigma, bank_size)[rng.integers(bank_size)]
+            if (bank_height, bank_width) != (height, width):
+                # The blur of the banked field spans more (or fewer) pixels, which weakens (or strengthens)
+                # it in proportion: scale it back to the strength of a field blurred at this size
+                field = np.stack([cv2.resize(component, (width, height), interpolation=cv2.INTER_LINEAR)
+                                  for component in field]) * np.float32(bank_width / width)
+            # Flipping the sign of dx and dy turns every banked field into four
+            return field * (rng.choice([-alpha, alpha], size=(2, 1, 1))).astype(np.float32)
+        return _elastic_field(height, width, width * sigma, rng) * np.float32(alpha)
+
+    @staticmethod
+    def elastic_array(img, alpha, sigma, rng=None, bank_size=0):
+        """Elastic transformation of an HxWxC numpy array, returns a new array of the same shape."""
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        field = RandomElastic.displacement(height, width, alpha, sigma, rng, bank_size, channels)
+
+        # A single 2D field moves all channels together, applied by one remap
+        x, y = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        return cv2.remap(img, x + field[0], y + field[1], interpolation=cv2.INTER_NEAREST, borderMode=cv2.BORDER_REFLECT)
+
+    def __call__(self, img, mask=None, rng=None):
+        return self.RandomElasticCV2(np.array(img), self.alpha, self.sigma, mask, rng, self.bank_size)
 
     def __repr__(self):
         format_string = self.__class__.__name__ + '(alpha value={0})'.format(self.alpha)
@@ -0,0 +1,212 @@
+import math
+from collections import namedtuple
+import cv2
+import numpy as np
+from color_lut import ColorChain, apply_color_chains
+from geometry import WarpFit, fit_warp, unwarp, outline_points, alpha_hull, unpremultiply
+
+# cv2.remap takes images of fewer than 32767 rows, stacks and sample maps are split to stay below that many rows
+REMAP_MAX_ROWS = 32000
+# Output pixels per stack, bounds the memory taken by the per-sample coordinates of a stack
+MAX_STACK_PIXELS = 1 << 18
+# Width of the sample maps, the samples of a stack are laid out in rows of this many pixels
+REMAP_WIDTH = 256
+
+# One overlay to augment: level is the pyramid level it is made from and hull the convex hull of its
+# non-transparent pixels (Sign.hulls), color_chain a ColorChain, occlusion an (x, y, width, height)
+# rectangle of the level or None, angle, shear and radial as in warp_overlay and elastic a
+# 2 x output_size x output_size displacement field (basic_augmentation.elastic_displacement) or None.
+OverlayJob = namedtuple("OverlayJob", ["level", "hull", "output_size", "color_chain", "occlusion",
+                                       "angle", "shear", "radial", "elastic"])
+
+def augment_overlays(jobs):
+    """
+    Augment the overlays of a batch of jobs and return them in order, as output_size x output_size x 4
+    premultiplied uint8 overlays ready for compositing.composite().
+
+    The jobs are grouped by the size of their pyramid level into N x H x W x 4 stacks and every stack goes
+    through each step at once, see augment_stack(). Every overlay keeps its own parameters, and the
+    result of a job does not depend on the other jobs of the batch.
+    """
+    stacks = {}
+    for i, job in enumerate(jobs):
+        stacks.setdefault(job.level.shape, []).append(i)
+    # Split the stacks to stay below REMAP_MAX_ROWS rows and MAX_STACK_PIXELS output pixels
+    batches = []
+    for shape, members in stacks.items():
+        batch, pixels = [], 0
+        for i in members:
+            pixels += jobs[i].output_size ** 2
+            if batch and ((len(batch) + 1) * (shape[0] + 2) > REMAP_MAX_ROWS or pixels > MAX_STACK_PIXELS):
+                batches.append(batch)
+                batch, pixels = [], jobs[i].output_size ** 2
+            batch.append(i)
+        batches.append(batch)
+
+    overlays = [None] * len(jobs)
+    for batch in batches:
+        for i, overlay in zip(batch, augment_stack([jobs[i] for i in batch])):
+            overlays[i] = overlay
+    return overlays
+
+def warp_overlay(overlay, output_size, angle=0.0, shear=0.0, radial=0.0, premultiplied=False):
+    """
+    Rotate, shear, radially distort and resize an RGBA overlay in a single remap.
+
+    The geometric steps are composed into one mapping from the output canvas back to the overlay. The
+    canvas is fitted to the warped outline of the non-transparent pixels, so no padding or cropping is
+    needed and the sign fills the canvas like a rotated, sheared, distorted, cropped and resized overlay
+    would. The overlay goes through augment_overlays() as a job of its own, so it gets the same pixels as
+    the signs of main.py.
+    Args:
+        overlay (numpy.ndarray): HxWx4 uint8 RGBA overlay.
+        output_size (int): width and height of the result.
+        angle (float): rotation in degrees, counter-clockwise.
+        shear (float): horizontal shear factor, as in apply_shear.
+        radial (float): radial distortion strength, see PINCUSHION_RANGE and BARREL_RANGE.
+        premultiplied (bool): keep the colors multiplied by alpha, ready for compositing.composite().
+    Returns:
+        numpy.ndarray: output_size x output_size x 4 uint8 RGBA overlay.
+    """
+    job = OverlayJob(overlay, alpha_hull(overlay[..., 3]), output_size, ColorChain(), None, angle, shear, radial, None)
+    warped = augment_overlays([job])[0]
+    if premultiplied:
+        return warped
+    return unpremultiply(warped.astype(np.float32))
+
+def augment_stack(jobs):
+    """
+    Augment jobs whose levels all have the same size: color chains, occlusions, then rotation, shear,
+    radial distortion and the resize to the output size in a single remap of the stack, and the elastic
+    distortions.
+    """
+    # Stacking copies the levels, they are shared by every overlay made from them
+    stack = np.stack([job.level for job in jobs])
+    apply_color_chains(stack, [job.color_chain for job in jobs])
+    occlude_stack(stack, [job.occlusion for job in jobs])
+    return warp_stack(stack, jobs)
+
+def occlude_stack(stack, occlusions):
+    """
+    Fill the (x, y, width, height) occlusion rectangle of every image of an N x H x W x 4 stack with
+    opaque black, in place. None leaves an image unchanged.
+    """
+    boxes = np.array([occlusion or (0, 0, 0, 0) for occlusion in occlusions])
+    if not boxes[:, 2:].any():
+        return stack
+    height, width = stack.shape[1:3]
+    rows = np.arange(height)[None, :]
+    columns = np.arange(width)[None, :]
+    inside_rows = (rows >= boxes[:, 1:2]) & (rows < boxes[:, 1:2] + boxes[:, 3:4])
+    inside_columns = (columns >= boxes[:, 0:1]) & (columns < boxes[:, 0:1] + boxes[:, 2:3])
+    stack[inside_rows[:, :, None] & inside_columns[:, None, :]] = (0, 0, 0, 255)
+    return stack
+
+def premultiplied_mips(stack, levels):
+    """
+    The N x H x W x 4 uint8 stack with premultiplied colors followed by levels successive 2 x 2 box-filtered
+    halvings, computed for the whole stack at once. An odd last row or column is dropped by the halving.
+    """
+    count, height, width = stack.shape[:3]
+    mip = cv2.cvtColor(stack.reshape(-1, width, 4), cv2.COLOR_RGBA2mRGBA).reshape(stack.shape)
+    mips = [mip]
+    for _ in range(levels):
+        height, width = height // 2, width // 2
+        # The stack as one tall image, an exact halving averages 2 x 2 blocks that never straddle two images
+        tall = np.ascontiguousarray(mip[:, :2 * height, :2 * width]).reshape(-1, 2 * width, 4)
+        mip = cv2.resize(tall, (width, count * height), interpolation=cv2.INTER_AREA).reshape(count, height, width, 4)
+        mips.append(mip)
+    return mips
+
+def _reflect(index, size):
+    # Pixel indices mirrored at the edges like cv2.BORDER_REFLECT (fedcba|abcdef|fedcba)
+    index = np.where(index < 0, -index - 1, index)
+    index = np.where(index >= size, 2 * size - 1 - index, index)
+    return np.clip(index, 0, size - 1)
+
+def warp_stack(stack, jobs):
+    """
+    Warp every image of an N x H x W x 4 stack to its own output size in one cv2.remap.
+
+    Each output is fitted to the warped outline of its image, see warp_overlay. Instead of shrinking every
+    source to its output first, the premultiplied stack is halved as a whole into mip levels and each
+    job samples the level closest to one source pixel per output pixel. The levels the jobs need are laid
+    out as one tall image with a transparent border around every image, and the output pixels of all the
+    jobs as one list of samples into it. The elastic distortion then moves whole output pixels, like a
+    nearest-neighbour remap of the warped overlay.
+    """
+    count, height, width = stack.shape[:3]
+    center = (width / 2, height / 2)
+    sizes = np.array([job.output_size for job in jobs])
+    parameters, levels = [], []
+    for job in jobs:
+        hull = job.hull
+        if job.occlusion is not None:
+            x, y, occlusion_width, occlusion_height = job.occlusion
+            corners = np.array([[x, y], [x + occlusion_width, y], [x, y + occlusion_height],
+                                [x + occlusion_width, y + occlusion_height]], dtype=np.float32)
+            hull = cv2.convexHull(np.concatenate([hull.astype(np.float32), corners])).reshape(-1, 2).astype(np.float64)
+        # Without radial distortion the warped outline is bounded by the warped hull corners
+        fit = fit_warp(outline_points(hull) if job.radial else hull, center, job.angle, job.shear, job.radial)
+        level = min(max(0, round(math.log2(min(fit.extent) / job.output_size))), int(math.log2(min(height, width))))
+        # Rows of the parameters: warped position of the first pixel center and step between pixels,
+        # radial center, radius and strength, then the inverse affine part and the center scaled straight
+        # to the padded mip level (pixel centers at integers after one pixel of border), and the largest
+        # coordinate still on the border of the level
+        scale = 0.5 ** level
+        parameters.append(np.concatenate([fit.low + 0.5 * fit.extent / job.output_size, fit.extent / job.output_size,
+                                          fit.radial_center, [fit.radial_radius, fit.radial], (fit.inverse * scale).ravel(),
+                                          fit.center * scale + 0.5, [(width >> level) + 1, (height >> level) + 1]]))
+        levels.append(level)
+    mips = premultiplied_mips(stack, max(levels))
+
+    # The images each level is needed for, one slot of the tall image each
+    levels = np.array(levels)
+    slots = np.zeros(count, dtype=np.int32)
+    tall = []
+    for level, mip in enumerate(mips):
+        members = np.flatnonzero(levels == level)
+        padded = np.zeros((len(members), mip.shape[1] + 2, width + 2, 4), dtype=np.uint8)
+        padded[:, 1:-1, 1:mip.shape[2] + 1] = mip[members]
+        slots[members] = sum(len(part) for part in tall) + np.arange(len(members)) * (mip.shape[1] + 2)
+        tall.append(padded.reshape(-1, width + 2, 4))
+    tall = np.concatenate(tall)
+
+    # One sample per output pixel, owner is its job; the parameters of every sample are kept as rows so
+    # every field is read contiguously
+    pixel_counts = sizes * sizes
+    pixel_starts = np.cumsum(pixel_counts) - pixel_counts
+    total = int(pixel_counts.sum())
+    padded_total = total + (-total % REMAP_WIDTH)
+    owner = np.repeat(np.arange(count, dtype=np.int32), pixel_counts)
+    row, column = np.divmod(np.arange(total, dtype=np.int32) - np.repeat(pixel_starts.astype(np.int32), pixel_counts),
+                            np.repeat(sizes.astype(np.int32), pixel_counts))
+    sample = np.repeat(np.array(parameters, dtype=np.float32).T, pixel_counts, axis=1)
+    points = np.stack([sample[0] + column.astype(np.float32) * sample[2], sample[1] + row.astype(np.float32) * sample[3]])
+    fit = WarpFit(sample[12:14].T, sample[8:12].T.reshape(-1, 2, 2), None, None, sample[4:6].T, sample[6], sample[7])
+    source = np.zeros((padded_total, 2), dtype=np.float32)
+    # Kept on the transparent border of the slot
+    np.clip(unwarp(fit, points.T), 0, sample[14:16].T, out=source[:total])
+
+    # Fixed-point coordinates computed per job before the offset to its slot in the tall image, so a job
+    # is sampled the same whatever the other jobs
+    coordinates, fractions = cv2.convertMaps(source.reshape(-1, REMAP_WIDTH, 2), None, cv2.CV_16SC2)
+    coordinates.reshape(-1, 2)[:total, 1] += slots[owner].astype(np.int16)
+    pixels = []
+    for start in range(0, len(coordinates), REMAP_MAX_ROWS):
+        pixels.append(cv2.remap(tall, coordinates[start:start + REMAP_MAX_ROWS], fractions[start:start + REMAP_MAX_ROWS],
+                                interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT, borderValue=0))
+    pixels = np.concatenate(pixels).reshape(-1, 4)[:total]
+
+    elastic = [i for i, job in enumerate(jobs) if job.elastic is not None]
+    if elastic:
+        # Each output pixel takes the pixel its displacement points to, of the same job
+        index = np.concatenate([pixel_starts[i] + np.arange(pixel_counts[i]) for i in elastic])
+        displacement = np.concatenate([jobs[i].elastic.reshape(2, -1) for i in elastic], axis=1)
+        size = sizes[owner[index]]
+        row = _reflect(np.rint(row[index] + displacement[1]).astype(np.int64), size)
+        column = _reflect(np.rint(column[index] + displacement[0]).astype(np.int64), size)
+        pixels[index] = pixels[pixel_starts[owner[index]] + row * size + column]
+
+    return [pixels[start:start + pixel_count].reshape(output_size, output_size, 4)
+            for start, pixel_count, output_size in zip(pixel_starts, pixel_counts, sizes)]
@@ -0,0 +1,68 @@
+import math
+import cv2
+import numpy as np
+from rng import get_rng
+
+# Longest side of the occupancy grid in cells, larger backgrounds use cells of several pixels
+MAX_GRID_SIZE = 512
+
+class PlacementGrid(object):
+    """Places non-overlapping rectangles on a background by sampling only from the free positions.
+
+    Placed rectangles are marked in an occupancy grid of cell_size x cell_size pixel cells. The summed-area
+    table of the grid (cv2.integral) gives the number of occupied cells under a new rectangle at every
+    candidate position at once, so a position is drawn from the valid ones in a single step and the cost
+    does not grow with the number of rectangles already placed. Rectangles keep at least margin pixels
+    between them, like are_overlapping. Positions are aligned to the cells.
+    Args:
+        width (int): width of the background.
+        height (int): height of the background.
+        cell_size (int): side of a grid cell in pixels, None picks one from MAX_GRID_SIZE.
+        margin (int): minimum gap between two rectangles.
+    """
+    def __init__(self, width, height, cell_size=None, margin=1):
+        if cell_size is None:
+            cell_size = max(1, math.ceil(max(width, height) / MAX_GRID_SIZE))
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.margin = margin
+        # One more cell than needed on the right and bottom, the margin of a rectangle may stick out
+        self.occupied = np.zeros((math.ceil((height + margin) / cell_size), math.ceil((width + margin) / cell_size)), dtype=np.uint8)
+
+    def _cells(self, size):
+        return math.ceil((size + self.margin) / self.cell_size)
+
+    def place(self, rect_width, rect_height, rng=None):
+        """
+        A random free (x, y, rect_width, rect_height) rectangle inside the background, or None when there is no room left.
+        Does not mark it, see add().
+        """
+        if rect_width > self.width or rect_height > self.height:
+            return None
+        cells_x, cells_y = self._cells(rect_width), self._cells(rect_height)
+        positions_x = (self.width - rect_width) // self.cell_size + 1
+        positions_y = (self.height - rect_height) // self.cell_size + 1
+
+        # Occupied cells under the rectangle at every cell-aligned top-left position
+        table = cv2.integral(self.occupied)
+        counts = (table[cells_y:cells_y + positions_y, cells_x:cells_x + positions_x]
+                  - table[:positions_y, cells_x:cells_x + positions_x]
+                  - table[cells_y:cells_y + positions_y, :positions_x]
+                  + table[:positions_y, :positions_x])
+        free = np.flatnonzero(counts == 0)
+        if len(free) == 0:
+            return None
+        row, column = divmod(int(free[get_rng(rng).integers(len(free))]), positions_x)
+        return (column * self.cell_size, row * self.cell_size, rect_width, rect_height)
+
+    def add(self, rect):
+        """
+        Mark an (x, y, width, height) rectangle as occupied.
+        """
+        x, y, rect_width, rect_height = rect
+        self.occupied[y // self.cell_size:math.ceil((y + rect_height + self.margin) / self.cell_size),
+                      x // self.cell_size:math.ceil((x + rect_width + self.margin) / self.cell_size)] = 1
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(width={0}, height={1}, cell_size={2})'.format(self.width, self.height, self.cell_size)
@@ -0,0 +1,25 @@
+import secrets
+import numpy as np
+
+def new_run_seed():
+    """
+    A fresh random run seed, print or store it to reproduce the run later.
+    """
+    return secrets.randbits(63)
+
+def image_rng(run_seed, idx):
+    """
+    The random generator of image idx in the run seeded with run_seed.
+    It only depends on (run_seed, idx), so any image can be re-rendered on its own and the
+    result does not depend on the order or the process the images are rendered in.
+    """
+    return np.random.default_rng(np.random.SeedSequence([run_seed, idx]))
+
+def get_rng(rng=None):
+    """
+    Return rng, or when it is None a generator drawn from the global numpy RNG, so callers
+    that don't pass a generator stay reproducible through np.random.seed().
+    """
+    if rng is None:
+        return np.random.default_rng(np.random.randint(2**31))
+    return rng
@@ -0,0 +1,132 @@
+import io
+import os
+import json
+import tarfile
+import threading
+
+def shard_name(shard_id):
+    return f"shard-{shard_id:05d}.tar"
+
+def index_path(shard_path):
+    return os.path.splitext(shard_path)[0] + ".idx.json"
+
+class ShardWriter(object):
+    """Pack samples into fixed-size, WebDataset-style tar shards with a random-access index.
+
+    Every sample is stored as <key><extension> members (e.g. 42.png and 42.json),
+    and each shard-XXXXX.tar gets a shard-XXXXX.idx.json mapping key -> {extension: [offset, size]}
+    so a single member can be read back with one seek, see read_sample().
+    A shard is written under a .tmp name and renamed when it is full or the writer is closed.
+    Args:
+        output_dir (str): directory the shards are written to.
+        max_shard_bytes (int): a new shard is started once the current one reaches this size.
+        resume_state (dict): a state() snapshot to continue an interrupted run from.
+    """
+    def __init__(self, output_dir, max_shard_bytes=1 << 30, resume_state=None):
+        self.output_dir = output_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.shard_id = 0
+        self.shards_written = 0
+        self._index = {}
+        self._file = None
+        self._tar = None
+        self._lock = threading.Lock()
+        if resume_state is not None:
+            self._resume(resume_state)
+
+    @property
+    def shard_path(self):
+        return os.path.join(self.output_dir, shard_name(self.shard_id))
+
+    def _open(self, offset=None):
+        temp_path = self.shard_path + ".tmp"
+        if offset is None:
+            self._file = open(temp_path, "wb")
+        else:
+            if not os.path.exists(temp_path):
+                # The interrupted run closed the shard on its way out, reopen it
+                os.replace(self.shard_path, temp_path)
+                os.remove(index_path(self.shard_path))
+            # Drop the samples written after the snapshot, TarFile keeps appending from the file position
+            self._file = open(temp_path, "r+b")
+            self._file.truncate(offset)
+            self._file.seek(offset)
+        self._tar = tarfile.TarFile(fileobj=self._file, mode="w", format=tarfile.USTAR_FORMAT)
+
+    def _resume(self, state):
+        self.shard_id = state["shard_id"]
+        self.shards_written = state["shard_id"]
+        if state["offset"] is not None:
+            self._index = state["index"]
+            self._open(state["offset"])
+
+    def __call__(self, name, data, metadata=None):
+        """
+        Add one sample, name is the image file name whose stem becomes the key.
+        Returns the number of bytes added to the shard.
+        """
+        key, extension = os.path.splitext(name)
+        members = [(extension, data)]
+        if metadata is not None:
+            members.append((".json", json.dumps(metadata).encode()))
+        with self._lock:
+            if self._tar is None:
+                self._open()
+            start = self._tar.offset
+            entry = {}
+            for member_extension, member_data in members:
+                tarinfo = tarfile.TarInfo(key + member_extension)
+                tarinfo.size = len(member_data)
+                self._tar.addfile(tarinfo, io.BytesIO(member_data))
+                # The data of a member ends on a 512-byte block right before the current offset
+                blocks = (tarinfo.size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+                entry[member_extension] = [self._tar.offset - blocks * tarfile.BLOCKSIZE, tarinfo.size]
+            self._index[key] = entry
+            nbytes = self._tar.offset - start
+            if self._tar.offset >= self.max_shard_bytes:
+                self._finish_shard()
+        return nbytes
+
+    def _finish_shard(self):
+        self._tar.close()
+        self._file.close()
+        with open(index_path(self.shard_path), "w") as index_file:
+            json.dump(self._index, index_file)
+        os.replace(self.shard_path + ".tmp", self.shard_path)
+        self._tar = None
+        self._file = None
+        self._index = {}
+        self.shard_id += 1
+        self.shards_written += 1
+
+    def state(self):
+        """
+        Sync the open shard to disk and return a snapshot that the writer can be resumed from.
+        """
+        with self._lock:
+            if self._tar is None:
+                return {"shard_id": self.shard_id, "offset": None, "index": {}}
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return {"shard_id": self.shard_id, "offset": self._tar.offset, "index": dict(self._index)}
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._finish_shard()
+
+def load_index(shard_path):
+    with open(index_path(shard_path)) as index_file:
+        return json.load(index_file)
+
+def read_sample(shard_path, key, extension, index=None):
+    """
+    Read one member of a sample, e.g. read_sample("shard-00000.tar", "42", ".json"),
+    with a single seek. Pass the loaded index to avoid re-reading it for every sample.
+    """
+    if index is None:
+        index = load_index(shard_path)
+    offset, size = index[key][extension]
+    with open(shard_path, "rb") as shard_file:
+        shard_file.seek(offset)
+        return shard_file.read(size)
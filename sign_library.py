@@ -0,0 +1,158 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+from geometry import downscale_overlay, alpha_hull
+
+SIGN_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MANIFEST_FILENAME = ".sign_library.npz"
+# Pyramid levels are halved down to this size
+PYRAMID_MIN_SIZE = 16
+# A level is used for an output when it is at least this much larger than the output
+PYRAMID_MARGIN = 1.25
+
+# image is an RGBA uint8 array cropped to the alpha bounding box of the sign,
+# pyramid is a tuple of the image and its successive halvings, largest first,
+# hulls the convex hull of the non-transparent pixels of every level (see geometry.alpha_hull)
+Sign = namedtuple("Sign", ["file_name", "category_id", "image", "pyramid", "hulls"])
+
+def parse_category_name(file_name):
+    """
+    Get the category name from a sign file name, e.g. "no_left_2.png" -> "no_left".
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    name, _, suffix = stem.rpartition("_")
+    return name if name and suffix.isdigit() else stem
+
+def load_sign(path):
+    """
+    Decode a sign overlay to RGBA and crop it to the bounding box of its non-transparent pixels.
+    """
+    with Image.open(path) as image:
+        overlay = image.convert("RGBA")
+    bbox = overlay.getchannel("A").getbbox()
+    if bbox is not None:
+        overlay = overlay.crop(bbox)
+    return np.array(overlay)
+
+def build_pyramid(image, min_size=PYRAMID_MIN_SIZE):
+    """
+    The mip pyramid of an RGBA overlay: the overlay followed by area-averaged halvings
+    until the next one would be smaller than min_size.
+    """
+    levels = [image]
+    while min(levels[-1].shape[:2]) // 2 >= min_size:
+        height, width = levels[-1].shape[:2]
+        levels.append(downscale_overlay(levels[-1], (width // 2, height // 2)))
+    return tuple(levels)
+
+def level_index(pyramid, output_size, margin=PYRAMID_MARGIN):
+    """
+    Index in pyramid of the smallest level whose longest side is still at least margin * output_size,
+    or 0 (the full-resolution level) when none is.
+    """
+    for index in reversed(range(len(pyramid))):
+        if max(pyramid[index].shape[:2]) >= margin * output_size:
+            return index
+    return 0
+
+def make_sign(file_name, category_id, pyramid):
+    """
+    A Sign from its pyramid, the hulls are recomputed rather than stored in the manifest.
+    """
+    return Sign(file_name, category_id, pyramid[0], pyramid, tuple(alpha_hull(level[..., 3]) for level in pyramid))
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+class SignLibrary(object):
+    """All sign overlays decoded once, cropped to their alpha bounds and mapped to category ids.
+
+    Every sign keeps a mip pyramid so it can be augmented close to the size it is pasted at, see level_index().
+    The library can be saved to a manifest (.npz) next to the signs so later runs skip decoding
+    and file name parsing, it is rebuilt when the sign files or the categories change.
+    Args:
+        signs (list of Sign): the decoded signs.
+        signatures (dict): file name -> [size, mtime_ns] of every sign file seen while building.
+        categories_dict (dict): category name -> id used to build the library.
+    """
+    def __init__(self, signs, signatures, categories_dict):
+        self.signs = signs
+        self.signatures = signatures
+        self.categories_dict = dict(categories_dict)
+
+    @classmethod
+    def build(cls, overlays_path, categories_dict):
+        signs = []
+        signatures = {}
+        for file_name in sorted(os.listdir(overlays_path)):
+            if not file_name.endswith(SIGN_EXTENSIONS):
+                continue
+            path = os.path.join(overlays_path, file_name)
+            signatures[file_name] = _file_signature(path)
+            category_name = parse_category_name(file_name)
+            if category_name not in categories_dict:
+                print(f"Skipping {file_name}: unknown category '{category_name}'")
+                continue
+            signs.append(make_sign(file_name, categories_dict[category_name], build_pyramid(load_sign(path))))
+        return cls(signs, signatures, categories_dict)
+
+    @classmethod
+    def load(cls, manifest_path):
+        with np.load(manifest_path) as data:
+            manifest = json.loads(str(data["manifest"]))
+            signs = []
+            for i, entry in enumerate(manifest["signs"]):
+                pyramid = tuple(data[f"image_{i}_{level}"] for level in range(entry["levels"]))
+                signs.append(make_sign(entry["file_name"], entry["category_id"], pyramid))
+        return cls(signs, manifest["signatures"], manifest["categories"])
+
+    def save(self, manifest_path):
+        manifest = {
+            "categories": self.categories_dict,
+            "signatures": self.signatures,
+            "signs": [{"file_name": sign.file_name, "category_id": sign.category_id, "levels": len(sign.pyramid)}
+                      for sign in self.signs]
+        }
+        arrays = {f"image_{i}_{level}": image for i, sign in enumerate(self.signs) for level, image in enumerate(sign.pyramid)}
+        # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+        temp_path = manifest_path + ".tmp.npz"
+        np.savez(temp_path, manifest=json.dumps(manifest), **arrays)
+        os.replace(temp_path, manifest_path)
+
+    def is_up_to_date(self, overlays_path, categories_dict):
+        if self.categories_dict != dict(categories_dict):
+            return False
+        file_names = [f for f in os.listdir(overlays_path) if f.endswith(SIGN_EXTENSIONS)]
+        if sorted(file_names) != sorted(self.signatures):
+            return False
+        return all(_file_signature(os.path.join(overlays_path, f)) == self.signatures[f] for f in file_names)
+
+    def __len__(self):
+        return len(self.signs)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(signs={0})'.format(len(self.signs))
+
+def load_sign_library(overlays_path, categories_dict, manifest_path=None):
+    """
+    Load the sign library from its manifest, rebuilding and saving it when missing or stale.
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(overlays_path, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        try:
+            library = SignLibrary.load(manifest_path)
+            if library.is_up_to_date(overlays_path, categories_dict):
+                return library
+        except Exception as e:
+            print(f"Error in loading sign manifest {manifest_path}: {e}")
+    library = SignLibrary.build(overlays_path, categories_dict)
+    try:
+        library.save(manifest_path)
+        print(f"Sign manifest saved to {manifest_path}")
+    except OSError as e:
+        print(f"Error in saving sign manifest {manifest_path}: {e}")
+    return library
@@ -0,0 +1,164 @@
+import queue
+import itertools
+import multiprocessing
+import main
+from background_cache import BackgroundCache
+from sign_library import load_sign_library
+from rng import new_run_seed
+
+try:
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    IterableDataset = object
+
+    def get_worker_info():
+        return None
+
+def get_options(**overrides):
+    """
+    The command line defaults of main.py, with overrides applied, e.g. get_options(resize=True).
+    """
+    opt = main.get_parser().parse_args([])
+    for key, value in overrides.items():
+        if not hasattr(opt, key):
+            raise TypeError("unknown option '{}'".format(key))
+        setattr(opt, key, value)
+    return opt
+
+class SyntheticTrafficSigns(object):
+    """In-memory generator of synthetic traffic sign samples.
+
+    Uses the same compositing and augmentation chain as main.main, but yields the images directly
+    instead of writing them to disk. Sample idx only depends on (opt.seed, idx), so it is identical
+    to image idx of a main.py run with the same seed. Each sample is (image, annotations), image is an HxWx3 uint8
+    RGB array and annotations a list of {"category_id", "bbox"} dicts with bbox as [x, y, width, height].
+    Args:
+        opt (argparse.Namespace): options as parsed by main.get_parser(), None uses get_options().
+        sign_library (SignLibrary): preloaded signs, None loads them from opt.overlays_path.
+    """
+    def __init__(self, opt=None, sign_library=None):
+        self.opt = get_options() if opt is None else opt
+        if self.opt.seed is None:
+            self.opt.seed = new_run_seed()
+        if sign_library is None:
+            sign_library = load_sign_library(self.opt.overlays_path, main.categories_dict, self.opt.sign_manifest)
+        self.sign_library = sign_library
+        self.background_images_list = main.list_backgrounds(self.opt.backgrounds_path)
+        self.background_cache = BackgroundCache(self.opt.background_cache_mb * 1024 * 1024)
+
+    def render(self, idx):
+        return self.render_batch([idx])[0]
+
+    def render_batch(self, indices):
+        """
+        Samples of several indices, their signs augmented in one batch (see main.render_images).
+        """
+        return [(image, [{"category_id": category_id, "bbox": bbox} for category_id, bbox in annotations])
+                for image, annotations in main.render_images(indices, self.opt, self.background_images_list,
+                                                             self.sign_library, self.background_cache)]
+
+    def generate(self, indices=None):
+        """
+        Yield a sample for every index in indices, forever when indices is None.
+        Samples are rendered opt.overlay_batch at a time.
+        """
+        indices = iter(itertools.count() if indices is None else indices)
+        while True:
+            chunk = list(itertools.islice(indices, self.opt.overlay_batch))
+            if not chunk:
+                return
+            yield from self.render_batch(chunk)
+
+    def __iter__(self):
+        return self.generate()
+
+def _produce(opt, sign_library, indices, sample_queue, stop_event, transform):
+    try:
+        generator = SyntheticTrafficSigns(opt, sign_library)
+        for image, annotations in generator.generate(indices):
+            if stop_event.is_set():
+                break
+            if transform is not None:
+                image, annotations = transform(image, annotations)
+            sample_queue.put((image, annotations))
+    finally:
+        sample_queue.put(None)
+
+class TrafficSignIterableDataset(IterableDataset):
+    """PyTorch IterableDataset streaming fresh synthetic samples with no disk round-trip.
+
+    Samples are rendered by background producer processes into a bounded prefetch queue.
+    Inside DataLoader workers, which cannot start processes of their own, each worker renders
+    inline and the loader's own workers and prefetching take over that role, the indices are
+    split between the loader workers.
+    Args:
+        opt (argparse.Namespace): options as parsed by main.get_parser(), None uses get_options().
+        length (int): number of samples per epoch, None streams forever.
+        num_producers (int): number of producer processes per iterator, 0 renders inline.
+        prefetch (int): maximum number of rendered samples waiting in the queue.
+        transform (callable): optional transform(image, annotations) -> (image, annotations)
+            applied inside the producers, e.g. conversion to tensors.
+    """
+    def __init__(self, opt=None, length=None, num_producers=2, prefetch=16, transform=None):
+        self.opt = get_options() if opt is None else opt
+        if self.opt.seed is None:
+            # Fixed here so every producer and loader worker derives its samples from the same seed
+            self.opt.seed = new_run_seed()
+        self.length = length
+        self.num_producers = num_producers
+        self.prefetch = prefetch
+        self.transform = transform
+        self.sign_library = load_sign_library(self.opt.overlays_path, main.categories_dict, self.opt.sign_manifest)
+
+    def _indices(self, producer_id, num_producers):
+        worker_info = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker_info is None else (worker_info.num_workers, worker_info.id)
+        start = worker_id * num_producers + producer_id
+        step = num_workers * num_producers
+        return range(start, self.length, step) if self.length is not None else itertools.count(start, step)
+
+    def __iter__(self):
+        if self.num_producers == 0 or get_worker_info() is not None:
+            return self._iter_inline()
+        return self._iter_producers()
+
+    def _iter_inline(self):
+        generator = SyntheticTrafficSigns(self.opt, self.sign_library)
+        for image, annotations in generator.generate(self._indices(0, 1)):
+            if self.transform is not None:
+                image, annotations = self.transform(image, annotations)
+            yield image, annotations
+
+    def _iter_producers(self):
+        context = multiprocessing.get_context()
+        sample_queue = context.Queue(maxsize=self.prefetch)
+        stop_event = context.Event()
+        producers = [context.Process(target=_produce, daemon=True,
+                                     args=(self.opt, self.sign_library, self._indices(producer_id, self.num_producers),
+                                           sample_queue, stop_event, self.transform))
+                     for producer_id in range(self.num_producers)]
+        for producer in producers:
+            producer.start()
+        try:
+            running = len(producers)
+            while running:
+                sample = sample_queue.get()
+                if sample is None:
+                    running -= 1
+                    continue
+                yield sample
+        finally:
+            stop_event.set()
+            # Unblock producers waiting on a full queue so they can see the stop event
+            while any(producer.is_alive() for producer in producers):
+                try:
+                    sample_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for producer in producers:
+                producer.join()
+
+    def __len__(self):
+        if self.length is None:
+            raise TypeError("an infinite dataset has no length")
+        return self.length
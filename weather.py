@@ -0,0 +1,55 @@
+from collections import namedtuple
+import numpy as np
+from color_lut import ColorChain, apply_color_chains
+from basic_augmentation import add_noise_stack
+from atmosphere import blend_densities
+
+# The background augmentation of one image, planned ahead so a whole block of backgrounds can be augmented
+# at once by apply_weather. technique is its name in the error messages, chain a ColorChain (brightness,
+# contrast, sun, the darkening of rain and snow), streaks the (flat pixel indices, RGB color) of rain drops
+# drawn after the chain (see rain_streaks), noise the (mean, std, layout) of Gaussian noise (see
+# noise_layout) and density the (low resolution density map, RGB color) of fog, haze or glare.
+WeatherJob = namedtuple("WeatherJob", ["technique", "chain", "streaks", "noise", "density"],
+                        defaults=(None, None, None, None))
+
+def apply_weather(images, jobs):
+    """
+    Apply jobs[i] (a WeatherJob, or None to leave the image unchanged) in place to images[i] of an
+    N x H x W x 3 uint8 stack of backgrounds and return the stack.
+
+    Every job keeps its own parameters, but each step runs once for all the images that need it: the color
+    chains through apply_color_chains, then per technique the rain drops as one indexed assignment, the
+    noise through add_noise_stack and the fog, haze or glare through blend_densities. The images of a
+    technique are processed in place when they are a contiguous run of the stack, render_images lays the
+    backgrounds out that way.
+    """
+    count, height, width, channels = images.shape
+    techniques = {}
+    for i, job in enumerate(jobs):
+        if job is not None:
+            techniques.setdefault(job.technique, []).append(i)
+    try:
+        apply_color_chains(images, [ColorChain() if job is None or job.chain is None else job.chain for job in jobs])
+    except Exception as e:
+        print(f"Error in color chains: {e}")
+
+    for technique, members in techniques.items():
+        group_jobs = [jobs[i] for i in members]
+        if all(job.streaks is None and job.noise is None and job.density is None for job in group_jobs):
+            continue
+        contiguous = members[-1] - members[0] + 1 == len(members)
+        group = images[members[0]:members[-1] + 1] if contiguous else images[members]
+        try:
+            if group_jobs[0].streaks is not None:
+                pixels = group.reshape(-1, channels)
+                pixels[np.concatenate([np.int64(k * height * width) + job.streaks[0] for k, job in enumerate(group_jobs)])] = \
+                    np.repeat([job.streaks[1] for job in group_jobs], [len(job.streaks[0]) for job in group_jobs], axis=0)
+            elif group_jobs[0].noise is not None:
+                add_noise_stack(group, *zip(*(job.noise for job in group_jobs)))
+            elif group_jobs[0].density is not None:
+                blend_densities(group, [job.density[0] for job in group_jobs], group_jobs[0].density[1])
+        except Exception as e:
+            print(f"Error in {technique}: {e}")
+        if not contiguous:
+            images[members] = group
+    return images